@@ -1,18 +1,19 @@
 from util import *
 import config
 import contestant
+import storage
+import timing
 
 
 g_init = False
 g_affiliations = dict()
 
 
-def write_affiliations_data():
-    path = Path('.') / 'data' / 'affiliations.tsv'
-    data = []
-    for shortname, fullname in g_affiliations.items():
-        data.append([shortname, fullname])
-    write_tsv(path, data)
+@timing.timed
+def write_affiliations_data(changed=None, removed=()):
+    if storage.defer('affiliations', write_affiliations_data, changed, removed):
+        return
+    storage.get_backend().write_affiliations(g_affiliations, changed, removed)
 
 
 def create_affiliation(shortname, fullname):
@@ -28,22 +29,30 @@ def get_affiliations():
         return g_affiliations
     g_init = True
 
-    path = Path('.') / 'data' / 'affiliations.tsv'
-    import_affiliations(path, silent=True, write=False)
+    with timing.span('load affiliations'):
+        for shortname, fullname in storage.get_backend().read_affiliations():
+            create_affiliation(shortname, fullname)
 
     return g_affiliations
 
 
+def reset():
+    """Forget the loaded affiliations so that they are read again when next needed."""
+    global g_init
+    g_init = False
+    g_affiliations.clear()
+
+
 def create_affiliation_interactive():
     shortname = ask_variable('shortname')
     fullname = ask_variable('full name')
     create_affiliation(shortname, fullname)
 
-    write_affiliations_data()
+    write_affiliations_data([shortname])
     info('Successfully added affiliation [{}] {}.'.format(shortname, fullname))
 
 
-def import_affiliations(path: Path, silent=False, write=True):
+def import_affiliations(path: Path):
     if not path.is_file():
         error('File not found: {}'.format(path))
     data = read_tsv(path)
@@ -51,15 +60,12 @@ def import_affiliations(path: Path, silent=False, write=True):
     for item in data:
         if len(item) != 2:
             invalid_format(path, item)
-        shortname = item[0]
-        fullname = item[1]
+    get_affiliations()
+    for shortname, fullname in data:
         create_affiliation(shortname, fullname)
 
-    if not silent:
-        info('Successfully imported {} affiliations.'.format(len(data)))
-
-    if write:
-        write_affiliations_data()
+    info('Successfully imported {} affiliations.'.format(len(data)))
+    write_affiliations_data([shortname for shortname, _ in data])
 
 
 def remove_affiliation(shortname):
@@ -74,7 +80,7 @@ def remove_affiliation(shortname):
     fullname = affiliations[shortname]
     affiliations.pop(shortname)
 
-    write_affiliations_data()
+    write_affiliations_data([], [shortname])
     info('Successfully deleted affiliation [{}] {}.'.format(shortname, fullname))
 
 
@@ -0,0 +1,87 @@
+import shlex
+import sys
+import time
+
+from util import *
+import server
+import storage
+import util
+
+
+# Commands that cannot be nested in a batch.
+BATCH_EXCLUDED_ACTIONS = ['batch', 'serve', 'shell']
+
+
+def read_commands(path):
+    """Return the (line number, argv) of every command in the file, or in the standard input for `-`."""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        path = Path(path)
+        if not path.is_file():
+            error('File not found: {}'.format(path))
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+    commands = list()
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            error('Line {}: cannot parse the command: {}.'.format(lineno, e))
+        if argv[0] in BATCH_EXCLUDED_ACTIONS:
+            error('Line {}: "{}" cannot be run inside a batch.'.format(lineno, argv[0]))
+        commands.append((lineno, argv))
+    return commands
+
+
+def print_timings(timings, commit_seconds):
+    width = 72
+    print(table_line(width))
+    print(table_row('Batch Timings', width))
+    print(table_line(width))
+    for lineno, argv, seconds in timings:
+        command = ' '.join(argv)
+        if len(command) > 48:
+            command = command[:45] + '...'
+        print(table_row('{:>5}  {:<48} {:>9.3f} s'.format(lineno, command, seconds), width, 2))
+    print(table_row('{:>5}  {:<48} {:>9.3f} s'.format('', '(write changes)', commit_seconds), width, 2))
+    print(table_line(width))
+    total = sum(seconds for _, _, seconds in timings) + commit_seconds
+    print(table_row('{} command(s) in {:.3f} s'.format(len(timings), total), width))
+    print(table_line(width))
+
+
+def run_batch(parser, run, path):
+    """Run the commands of a file one after another against the contest loaded once, then write all changes together.
+
+    Confirmations are answered yes. If a command fails the batch stops and no contest data is written.
+    """
+    if server.server_running():
+        error('A cas server is running for this contest, stop it before running a batch.')
+    commands = read_commands(path)
+
+    timings = list()
+    util.g_assume_yes = True
+    try:
+        with storage.transaction():
+            for lineno, argv in commands:
+                start = time.perf_counter()
+                try:
+                    run(parser.parse_args(argv))
+                except SystemExit as e:
+                    # user_abort() and --help end the command but not the batch.
+                    if e.code not in [0, None]:
+                        error('Line {}: "{}" failed, the batch was aborted and no contest data was written.'.format(lineno, ' '.join(argv)))
+                timings.append((lineno, argv, time.perf_counter() - start))
+            # The changes of every command are written when the transaction closes.
+            start = time.perf_counter()
+        commit_seconds = time.perf_counter() - start
+    finally:
+        util.g_assume_yes = False
+
+    print_timings(timings, commit_seconds)
+    info('Successfully ran {} command(s).'.format(len(timings)))
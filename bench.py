@@ -0,0 +1,201 @@
+import io
+import math
+import os
+import platform
+import random
+import tempfile
+import time
+from contextlib import redirect_stdout, redirect_stderr
+
+from util import *
+import contest
+import session
+import storage
+import util
+
+
+# Contestants per room and affiliation of the generated contests when they are not given.
+DEFAULT_ROOM_SIZE = 100
+DEFAULT_AFFILIATION_SIZE = 20
+# Seats per row of the generated rooms.
+ROW_WIDTH = 10
+TEAM_CATEGORY_IDS = [3, 4]
+TEAM_ID_BASE = 1000
+
+# Operations timed on each contest, in the order they run.
+OPERATIONS = ['import', 'seatall', 'genpass', 'load', 'export all', 'export sid_score', 'unseatall']
+
+
+def row_name(row):
+    name = ''
+    row += 1
+    while row > 0:
+        row, rest = divmod(row - 1, 26)
+        name = chr(ord('A') + rest) + name
+    return name
+
+
+def generate_contest(path: Path, contestants, rooms, affiliations, backend='json', seed=0):
+    """Create a contest directory with the seats and affiliations in place, and the files to import and score.
+
+    The contestants are left in `contestants.tsv` for `contestant import`; `results.tsv` is a DOMjudge
+    scoreboard for the team ids they get when imported into the empty contest.
+    """
+    rng = random.Random(seed)
+    (path / 'data').mkdir(parents=True)
+    contest.Contest(path=path, title='Bench {}'.format(contestants), team_category_ids=TEAM_CATEGORY_IDS,
+                    team_id_range=(TEAM_ID_BASE, TEAM_ID_BASE + 2 * contestants), account_prefix='team',
+                    lock=False, storage=backend).write()
+
+    # 10% spare seats, spread evenly over the rooms.
+    room_size = math.ceil(contestants * 1.1 / rooms)
+    seats = list()
+    coords = dict()
+    for r in range(rooms):
+        for k in range(room_size):
+            room, seat_id = 'Room{}'.format(r + 1), '{}{}'.format(row_name(k // ROW_WIDTH), k % ROW_WIDTH + 1)
+            seats.append((room, seat_id))
+            coords[(room, seat_id)] = (k // ROW_WIDTH, k % ROW_WIDTH)
+
+    target = storage.backends[backend](path=path, create=True)
+    target.write_affiliations(dict(('aff{}'.format(a), 'Affiliation {}'.format(a)) for a in range(affiliations)))
+    target.write_seats(seats, coords)
+    target.write_contestants(dict())
+
+    # Affiliation sizes follow an exponential distribution, as in real contests.
+    rows = list()
+    for i in range(contestants):
+        aff = min(int(rng.expovariate(4 / affiliations)), affiliations - 1)
+        rows.append(['name{}'.format(i), str(100000 + i), 'aff{}'.format(aff), str(rng.choice(TEAM_CATEGORY_IDS))])
+    write_tsv(path / 'contestants.tsv', rows)
+
+    scoreboard = [['results', '1']]
+    for i in range(contestants):
+        scoreboard.append([TEAM_ID_BASE + i, 0, '', rng.randint(0, 12), rng.randint(0, 3000), 0, ''])
+    write_tsv(path / 'results.tsv', scoreboard)
+    return len(seats)
+
+
+def run_timed(parser, run, argv):
+    """Run a command of cas in this process, and return how long it took in seconds."""
+    output = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(output), redirect_stderr(output):
+            run(parser.parse_args(argv))
+    except SystemExit as e:
+        if e.code not in [0, None]:
+            print(output.getvalue(), end='')
+            error('"cas {}" failed during the benchmark.'.format(' '.join(argv)))
+    return time.perf_counter() - start
+
+
+def time_load(datasets):
+    """Drop the loaded contest and time reading it from disk again."""
+    session.reset_state()
+    start = time.perf_counter()
+    contest.get_contest()
+    for load in datasets:
+        load()
+    return time.perf_counter() - start
+
+
+def bench_contest(parser, run, datasets):
+    timings = dict()
+    timings['import'] = run_timed(parser, run, ['contestant', 'import', 'contestants.tsv'])
+    timings['seatall'] = run_timed(parser, run, ['contestant', 'seatall'])
+    timings['genpass'] = run_timed(parser, run, ['contestant', 'genpass'])
+    timings['load'] = time_load(datasets)
+    # Exports need the contest locked, and seats cannot change while it is.
+    contest.get_contest().toggle_lock(True)
+    timings['export all'] = run_timed(parser, run, ['export', 'all'])
+    timings['export sid_score'] = run_timed(parser, run, ['export', 'sid_score', 'results.tsv'])
+    contest.get_contest().toggle_lock(False)
+    timings['unseatall'] = run_timed(parser, run, ['contestant', 'unseatall'])
+    return timings
+
+
+def growth_exponents(results):
+    """Return, for each operation, the exponent k of time ~ n^k between each size and the next one."""
+    res = dict()
+    for operation in OPERATIONS:
+        res[operation] = list()
+        for small, large in zip(results, results[1:]):
+            t_small, t_large = small['timings'][operation], large['timings'][operation]
+            if t_small <= 0 or t_large <= 0 or large['contestants'] == small['contestants']:
+                res[operation].append(None)
+                continue
+            res[operation].append(round(math.log(t_large / t_small) / math.log(large['contestants'] / small['contestants']), 2))
+    return res
+
+
+def print_results(results, exponents):
+    width = 96
+    print(table_line(width))
+    print(table_row('Benchmark (seconds)', width))
+    print(table_line(width))
+    print(table_row('{:<18}'.format('contestants') + ''.join('{:>12}'.format(r['contestants']) for r in results) +
+                    ''.join('{:>12}'.format('n^k') for _ in results[1:]), width, 2))
+    for operation in OPERATIONS:
+        print(table_row('{:<18}'.format(operation) + ''.join('{:>12.3f}'.format(r['timings'][operation]) for r in results) +
+                        ''.join('{:>12}'.format('-' if k is None else k) for k in exponents[operation]), width, 2))
+    print(table_line(width))
+
+
+def run_bench(parser, run, datasets, sizes, rooms=None, affiliations=None, backend='json', output=None, keep=None):
+    """Generate a contest of each size, time the main operations on it, and write the timings as JSON."""
+    if backend not in storage.backends:
+        invalid_arg('storage backend', backend)
+    if output is None:
+        output = Path('bench-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    output = Path(output).resolve()
+    if keep is not None:
+        root = Path(keep).resolve()
+        root.mkdir(parents=True, exist_ok=True)
+    else:
+        tmp = tempfile.TemporaryDirectory(prefix='cas-bench-')
+        root = Path(tmp.name)
+
+    cwd = os.getcwd()
+    results = list()
+    util.g_assume_yes = True
+    try:
+        for size in sizes:
+            room_num = rooms if rooms is not None else max(1, math.ceil(size / DEFAULT_ROOM_SIZE))
+            affiliation_num = affiliations if affiliations is not None else max(1, math.ceil(size / DEFAULT_AFFILIATION_SIZE))
+            path = root / 'bench-{}'.format(size)
+            if path.exists():
+                error('{} exists.'.format(path))
+            info('Generating a contest of {} contestants in {} rooms from {} affiliations.'.format(size, room_num, affiliation_num))
+            seat_num = generate_contest(path, size, room_num, affiliation_num, backend)
+
+            os.chdir(path)
+            session.reset_state()
+            try:
+                timings = bench_contest(parser, run, datasets)
+            finally:
+                session.reset_state()
+                os.chdir(cwd)
+            results.append({
+                'contestants': size,
+                'seats': seat_num,
+                'rooms': room_num,
+                'affiliations': affiliation_num,
+                'timings': dict((operation, round(timings[operation], 6)) for operation in OPERATIONS),
+            })
+    finally:
+        util.g_assume_yes = False
+        if keep is None:
+            tmp.cleanup()
+
+    exponents = growth_exponents(results)
+    print_results(results, exponents)
+    write_json(output, {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'storage': backend,
+        'results': results,
+        'growth_exponents': exponents,
+    })
+    info('Benchmark results written to {}.'.format(output))
@@ -10,6 +10,18 @@ default_args = {
     'manual_seat': False,
     'override_seat': False,
     'random_apply_seat': False,
+    'constant_memory': False,
+    'delta': False,
+    'ids': None,
+    'rooms': None,
+    'affiliations': None,
+    'categories': None,
+    'split': None,
+    'keep': None,
+    'compress': None,
+    'profile': False,
+    'profile_json': None,
+    'profile_cprofile': None,
 }
 
 
@@ -1,8 +1,11 @@
+import heapq
+
 from util import *
 import affiliation
 import contestant
 import seat
-from colorama import Fore
+import storage
+import timing
 
 
 class Contest:
@@ -12,24 +15,45 @@ class Contest:
     team_id_range: tuple
     account_prefix: str
     lock: bool
-    teamid_pool: set
-
-    def __init__(self, path, title, team_category_ids, team_id_range, account_prefix, lock):
+    storage: str
+    history_keep: int
+    history_compress: bool
+    teamid_free: set
+    teamid_heap: list
+    teamid_reserved: set
+
+    def __init__(self, path, title, team_category_ids, team_id_range, account_prefix, lock, storage='json',
+                 history_keep=0, history_compress=False):
         self.path = path
         self.title = title
         self.team_category_ids = team_category_ids
         self.team_id_range = team_id_range
-        self.teamid_pool = set(range(self.team_id_range[0], self.team_id_range[1] + 1))
+        # Free team ids, with a min-heap over them that may still hold ids occupied since they were pushed.
+        # A sorted list is already a valid heap.
+        self.teamid_free = set(range(self.team_id_range[0], self.team_id_range[1] + 1))
+        self.teamid_heap = list(range(self.team_id_range[0], self.team_id_range[1] + 1))
+        # Team ids set aside by reserve_teamids() and not occupied yet.
+        self.teamid_reserved = set()
         self.account_prefix = account_prefix
         self.lock = lock
-
-    def write(self):
+        self.storage = storage
+        # Retention policy of export history: number of entries kept per kind of export (0 for all), and whether
+        # the stored files are gzip-compressed.
+        self.history_keep = history_keep
+        self.history_compress = history_compress
+
+    def write(self, changed=None, removed=()):
+        if storage.defer('contest', self.write, changed, removed):
+            return
         write_yaml(self.path / 'contest.yaml', {
             'title': self.title,
             'team_category_ids': ",".join(map(str, self.team_category_ids)),
             'team_id_range': '{}-{}'.format(self.team_id_range[0], self.team_id_range[1]),
             'account_prefix': self.account_prefix,
             'lock': self.lock,
+            'storage': self.storage,
+            'history_keep': self.history_keep,
+            'history_compress': self.history_compress,
         })
 
     def toggle_lock(self, lock: bool):
@@ -43,27 +67,64 @@ class Contest:
         return min(self.team_id_range[1] - self.team_id_range[0] + 1, seat.get_seats_num())
 
     def get_available_teamid(self):
-        if len(self.teamid_pool) == 0:
+        while len(self.teamid_heap) > 0 and self.teamid_heap[0] not in self.teamid_free:
+            heapq.heappop(self.teamid_heap)
+        if len(self.teamid_heap) == 0:
             error('No available team id.')
-        return min(self.teamid_pool)
+        return self.teamid_heap[0]
+
+    def get_available_teamid_num(self):
+        return len(self.teamid_free)
+
+    def reserve_teamids(self, k, contiguous=False):
+        """Set aside the k lowest free team ids, or the lowest block of k consecutive ones, for occupy_teamid()."""
+        if k > len(self.teamid_free):
+            error('Only {} team id(s) are available, {} required.'.format(len(self.teamid_free), k))
+        if k == 0:
+            return list()
+        if not contiguous:
+            res = list()
+            while len(res) < k:
+                team_id = heapq.heappop(self.teamid_heap)
+                if team_id in self.teamid_free:
+                    res.append(team_id)
+        else:
+            start = self.team_id_range[0]
+            for team_id in range(self.team_id_range[0], self.team_id_range[1] + 1):
+                if team_id not in self.teamid_free:
+                    start = team_id + 1
+                elif team_id - start + 1 == k:
+                    break
+            else:
+                error('No {} consecutive team ids are available.'.format(k))
+            res = list(range(start, start + k))
+        self.teamid_free.difference_update(res)
+        self.teamid_reserved.update(res)
+        return res
 
     def occupy_teamid(self, team_id):
-        if team_id not in self.teamid_pool:
+        if team_id in self.teamid_reserved:
+            self.teamid_reserved.remove(team_id)
+            return True
+        if team_id not in self.teamid_free:
             return False
-        self.teamid_pool.remove(team_id)
+        self.teamid_free.remove(team_id)
         return True
 
     def release_teamid(self, team_id):
         if team_id < self.team_id_range[0] or team_id > self.team_id_range[1]:
             error('Team id {} is not in the valid range.'.format(team_id))
-        if team_id in self.teamid_pool:
+        if team_id in self.teamid_free or team_id in self.teamid_reserved:
             error('Unexpected: team id {} is already available.'.format(team_id))
-        self.teamid_pool.add(team_id)
+        self.teamid_free.add(team_id)
+        heapq.heappush(self.teamid_heap, team_id)
 
     def print(self):
         print("""
  title:               {}
  lock state:          {}
+ storage:             {}
+ export history:      {}
  team_category ids:   {}
  team_id range:       {}
  account_prefix:      {}
@@ -77,6 +138,9 @@ class Contest:
         """.format(
             self.title,
             self.locked()[1],
+            self.storage,
+            '{}{}'.format('all entries' if self.history_keep == 0 else 'last {} entries'.format(self.history_keep),
+                          ', compressed' if self.history_compress else ''),
             ", ".join(map(str, self.team_category_ids)),
             '{} ~ {}'.format(self.team_id_range[0], self.team_id_range[1]),
             self.account_prefix,
@@ -110,18 +174,28 @@ def get_contest():
 
     path = Path('.')
     ensure_contest_directory(path)
-    data = read_yaml(path / 'contest.yaml')
-    g_contest = Contest(
-        path=path,
-        title=data['title'],
-        team_category_ids=list(map(int, data['team_category_ids'].strip().split(','))),
-        team_id_range=decode_range(data['team_id_range'], 'team_id_rage'),
-        account_prefix=data['account_prefix'],
-        lock=bool(data['lock'])
-    )
+    with timing.span('load contest'):
+        data = read_yaml(path / 'contest.yaml')
+        g_contest = Contest(
+            path=path,
+            title=data['title'],
+            team_category_ids=list(map(int, data['team_category_ids'].strip().split(','))),
+            team_id_range=decode_range(data['team_id_range'], 'team_id_rage'),
+            account_prefix=data['account_prefix'],
+            lock=bool(data['lock']),
+            storage=data.get('storage', 'json'),
+            history_keep=int(data.get('history_keep', 0)),
+            history_compress=bool(data.get('history_compress', False))
+        )
     return g_contest
 
 
+def reset():
+    """Forget the loaded contest so that it is read again when next needed."""
+    global g_contest
+    g_contest = None
+
+
 def create_contest():
     title = ask_variable('contest name')
     dirname = ask_variable('directory name')
@@ -157,11 +231,9 @@ def toggle_lock(lock):
     ensure_contest_directory()
     contest = get_contest()
     if lock != contest.lock:
-        if not lock:
-            if ask_variable('Are you sure? (y/n)', 'n')[0] not in ['y', 'Y']:
-                user_abort()
+        if not lock and not ask_confirm('Are you sure to unlock the contest?', False):
+            user_abort()
         contest.toggle_lock(lock)
-        contest.write()
     contest.print()
 
 
@@ -191,6 +263,14 @@ def get_available_teamid():
     return get_contest().get_available_teamid()
 
 
+def get_available_teamid_num():
+    return get_contest().get_available_teamid_num()
+
+
+def reserve_teamids(k, contiguous=False):
+    return get_contest().reserve_teamids(k, contiguous)
+
+
 def get_ready_state():
     ready = Fore.GREEN + '[Ready]' + Fore.RESET
     not_ready = Fore.RED + '[Not Ready]' + Fore.RESET
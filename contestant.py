@@ -1,22 +1,30 @@
+import sys
+
 import affiliation
 from util import *
 import config
 import contest
 import seat
-from colorama import Fore
+import seating
+import storage
+import timing
 
 
 team_id2id = dict()
 
 
 class Contestant:
+    # Large contests hold one of these per contestant, so they carry no instance __dict__.
+    __slots__ = ('id', 'team_category', 'team_id', 'name', 'sid', 'aff', 'seat_handle', 'password')
+
     id: int
     team_category: int
     team_id: int
     name: str
     sid: str
     aff: str
-    seat_formatted_str: str
+    # Handle of the seat in the seat table of seat.py, None if unseated.
+    seat_handle: int
     password: str
 
     def __init__(self, contestant_id, team_category, team_id, name, sid, aff, seat_formatted_str=None, password=None):
@@ -26,15 +34,24 @@ class Contestant:
         team_id2id[self.team_id] = self.id
         self.name = name
         self.sid = sid
-        self.aff = aff
+        # Affiliations are shared by many contestants, so each shortname is kept once.
+        self.aff = sys.intern(aff)
         self.seat_formatted_str = seat_formatted_str
         self.password = password
 
+    @property
+    def seat_formatted_str(self):
+        return None if self.seat_handle is None else seat.handle_str(self.seat_handle)
+
+    @seat_formatted_str.setter
+    def seat_formatted_str(self, formatted_str):
+        self.seat_handle = None if formatted_str is None else seat.parse_seat_handle(formatted_str)
+
     def seated(self):
-        return self.seat_formatted_str is not None
+        return self.seat_handle is not None
 
-    def get_seat(self):
-        return seat.decode_seat(self.seat_formatted_str)
+    def get_room(self):
+        return seat.handle_room(self.seat_handle)
 
     def get_account(self):
         return contest.get_contest().account_prefix + str(self.team_id)
@@ -76,77 +93,153 @@ class Contestant:
 
 g_init = False
 g_contestants = dict()
-g_contestant_unique = set()
 g_contestant_max_id = 0
+# Secondary indexes used to find similar contestants: (affiliation, name) and (affiliation, sid) to contestant ids.
+# A key shared by several contestants maps to a tuple of their ids, any other key to the id itself: nearly all keys
+# are unique, and a set per key would take more memory than the contestants.
+g_index_aff_name = dict()
+g_index_aff_sid = dict()
+
+
+def index_add(index, key, contestant_id):
+    ids = index.get(key)
+    if ids is None:
+        index[key] = contestant_id
+    elif isinstance(ids, int):
+        index[key] = (ids, contestant_id)
+    else:
+        index[key] = ids + (contestant_id,)
+
+
+def index_discard(index, key, contestant_id):
+    ids = index_get(index, key)
+    if contestant_id not in ids:
+        return
+    ids = tuple(i for i in ids if i != contestant_id)
+    if len(ids) == 0:
+        index.pop(key)
+    else:
+        index[key] = ids[0] if len(ids) == 1 else ids
+
+
+def index_get(index, key):
+    ids = index.get(key, ())
+    return (ids,) if isinstance(ids, int) else ids
+
+
+def index_contestant(c: Contestant):
+    index_add(g_index_aff_name, (c.aff, c.name), c.id)
+    if c.sid:
+        index_add(g_index_aff_sid, (c.aff, c.sid), c.id)
+
+
+def unindex_contestant(c: Contestant):
+    index_discard(g_index_aff_name, (c.aff, c.name), c.id)
+    index_discard(g_index_aff_sid, (c.aff, c.sid), c.id)
 
 
+def get_similar_contestants(c: Contestant):
+    similar = set(index_get(g_index_aff_name, (c.aff, c.name)))
+    if c.sid:
+        similar.update(index_get(g_index_aff_sid, (c.aff, c.sid)))
+    similar.discard(c.id)
+    return sorted(similar)
+
+
+def is_duplicate(name, sid, aff):
+    """Return whether a contestant with the same name, SID and affiliation exists."""
+    return any(g_contestants[i].sid == sid for i in index_get(g_index_aff_name, (aff, name)))
+
+
+@timing.timed
 def create_contestant(contestant_id, team_cat, team_id, name, sid, aff, seat_formatted_str=None, password=None):
-    global g_init, g_contestants, g_contestant_unique, g_contestant_max_id
+    global g_init, g_contestants, g_contestant_max_id
 
-    if (name, sid, aff) in g_contestant_unique:
+    if is_duplicate(name, sid, aff):
         error('Duplicate contestant: name={} sid={} affiliation={}'.format(name, sid, aff))
     if aff not in affiliation.get_affiliations():
         error('Affiliation {} not found.'.format(aff))
     if seat_formatted_str is not None:
-        seat.occupy_seat(contestant_id, seat.decode_seat(seat_formatted_str))
+        seat.occupy_seat(contestant_id, seat.parse_seat_handle(seat_formatted_str))
     if not contest.valid_team_category(team_cat):
         error('Team category {} is not valid.'.format(team_cat))
     if not contest.occupy_teamid(team_id):
         error('Team id {} is not available (duplicate or out of range).'.format(team_id))
 
-    g_contestants[contestant_id] = Contestant(contestant_id, team_cat, team_id, name, sid, aff, seat_formatted_str, password)
-    g_contestant_unique.add((name, sid, aff))
+    c = Contestant(contestant_id, team_cat, team_id, name, sid, aff, seat_formatted_str, password)
+    g_contestants[contestant_id] = c
     g_contestant_max_id = max(g_contestant_max_id, contestant_id)
 
-    for _, c in g_contestants.items():
-        if c.id == contestant_id:
-            continue
-        similar = c.aff == aff and (c.name == name or (c.sid and c.sid == sid))
-        if similar:
-            warning('Contestant {} and {} have similar section.'.format(contestant_id, c.id))
+    for similar_id in get_similar_contestants(c):
+        warning('Contestant {} and {} have similar section.'.format(contestant_id, similar_id))
+    index_contestant(c)
+
+
+def decode_contestant(item):
+    contestant_id = int(item['id'])
+    team_cat = int(item['team_cat'])
+    team_id = int(item['team_id'])
+    name = item['name']
+    sid = item['sid'] if 'sid' in item and item['sid'] else ''
+    aff = item['affiliation']
+    seat_formatted_str = item['seat'] if 'seat' in item else None
+    password = item['password'] if 'password' in item else None
+    return contestant_id, team_cat, team_id, name, sid, aff, seat_formatted_str, password
 
 
 def get_contestants():
-    global g_init, g_contestants, g_contestant_unique, g_contestant_max_id
+    global g_init, g_contestants, g_contestant_max_id
 
     if g_init:
         return g_contestants
     g_init = True
 
-    path = Path('.') / 'data' / 'contestants.json'
-    data = list()
-    if path.is_file():
-        data = read_json(path)
-    else:
-        error('{} not found.'.format(path))
+    with timing.span('load contestants'):
+        for item in storage.get_backend().read_contestants():
+            create_contestant(*decode_contestant(item))
 
-    for item in data:
-        contestant_id = int(item['id'])
-        team_cat = int(item['team_cat'])
-        team_id = int(item['team_id'])
-        name = item['name']
-        sid = item['sid'] if 'sid' in item and item['sid'] else ''
-        aff = item['affiliation']
-        seat_formatted_str = item['seat'] if 'seat' in item else None
-        password = item['password'] if 'password' in item else None
+    return g_contestants
 
-        create_contestant(contestant_id, team_cat, team_id, name, sid, aff, seat_formatted_str, password)
 
-    return g_contestants
+def reset():
+    """Forget the loaded contestants so that they are read again when next needed."""
+    global g_init, g_contestant_max_id
+    g_init = False
+    g_contestant_max_id = 0
+    for d in [team_id2id, g_contestants, g_index_aff_name, g_index_aff_sid]:
+        d.clear()
 
 
-def write_contestant_data():
-    contestants = get_contestants()
-    path = Path('.') / 'data' / 'contestants.json'
-    data = list()
-    for contestant_id in contestants:
-        contestant = contestants[contestant_id]
-        data.append(contestant.serialize())
-    write_json(path, data)
+def find_contestant(field, value):
+    """Look up a single contestant by `id`, `team_id` or `seat`.
+
+    Uses the loaded contestants if there are any, otherwise asks the storage backend for that one row only.
+    """
+    if g_init:
+        if field == 'id':
+            return g_contestants.get(value)
+        if field == 'team_id':
+            return g_contestants.get(team_id2id.get(value))
+        if field == 'seat':
+            room, _, seat_id = value.partition('-')
+            return g_contestants.get(seat.get_seats()[0].get((room, seat_id)))
+        for _, c in g_contestants.items():
+            if c.serialize()[field] == value:
+                return c
+        return None
+    item = storage.get_backend().find_contestant(field, value)
+    return None if item is None else Contestant(*decode_contestant(item))
+
+
+@timing.timed
+def write_contestant_data(changed=None, removed=()):
+    if storage.defer('contestants', write_contestant_data, changed, removed):
+        return
+    storage.get_backend().write_contestants(get_contestants(), changed, removed)
 
 
 def get_available_id():
-    global g_init, g_contestants, g_contestant_unique, g_contestant_max_id
+    global g_init, g_contestants, g_contestant_max_id
     # Expect that global contest has been initialized.
     assert g_init
     g_contestant_max_id += 1
@@ -154,10 +247,10 @@ def get_available_id():
 
 
 def show_information(contestant_id, show_password):
-    contestants = get_contestants()
-    if contestant_id not in contestants:
+    c = find_contestant('id', contestant_id)
+    if c is None:
         error("Contestant {} not found.".format(contestant_id))
-    contestants[contestant_id].print(show_password)
+    c.print(show_password)
 
 
 def show_information_all(show_password):
@@ -186,36 +279,84 @@ def create_contestant_interactive():
     contestant_id = get_available_id()
     team_id = contest.get_available_teamid()
 
-    create_contestant(contestant_id, team_cat, team_id, name, sid, aff)
-    if require_seat:
-        seat_contestant(contestant_id, manual=False, random_apply=False, room_mask=None, override=False, write=False)
-    if gen_pass:
-        generate_password(contestant_id, config.args.pwd_alphabet, config.args.pwd_length)
+    with storage.transaction():
+        create_contestant(contestant_id, team_cat, team_id, name, sid, aff)
+        if require_seat:
+            seat_contestant(contestant_id, manual=False, random_apply=False, room_mask=None, override=False, write=False)
+        if gen_pass:
+            generate_password(contestant_id, config.args.pwd_alphabet, config.args.pwd_length)
 
-    write_contestant_data()
+        write_contestant_data([contestant_id])
     info('Successfully imported 1 contestant. (id = {})'.format(contestant_id))
 
 
-def import_contestant(path: Path):
+IMPORT_CHUNK_SIZE = 5000
+
+
+@timing.timed
+def check_import_row(para, seen):
+    """Return the problem with one row of a contestant tsv file, or None if it can be imported."""
+    if len(para) != 4:
+        return 'expected 4 fields, found {}'.format(len(para))
+    name, sid, aff, team_cat = para
+    if not re.match('-?[0-9]+$', team_cat.strip()):
+        return 'team category {} is not a number'.format(team_cat)
+    if not contest.valid_team_category(int(team_cat)):
+        return 'team category {} is not valid'.format(team_cat)
+    if aff not in affiliation.get_affiliations():
+        return 'affiliation {} not found'.format(aff)
+    if is_duplicate(name, sid, aff):
+        return 'duplicate of an existing contestant'
+    if (name, sid, aff) in seen:
+        return 'duplicate of line {}'.format(seen[(name, sid, aff)])
+    return None
+
+
+def import_contestant(path: Path, contiguous_team_ids=False):
+    """Import contestants from a tsv file, streamed in chunks of IMPORT_CHUNK_SIZE rows.
+
+    The whole file is checked before anything is applied, and every bad row is reported.
+    """
     if not path.is_file():
         error("File not found: {}".format(path))
-    lines = read_tsv(path)
-    if get_contestants_num() + len(lines) > contest.get_capacity():
+    get_contestants()
+
+    problems = list()
+    seen = dict()
+    total = 0
+    with timing.span('validate'):
+        for chunk in iter_chunks(iter_tsv(path), IMPORT_CHUNK_SIZE):
+            for para in chunk:
+                total += 1
+                problem = check_import_row(para, seen)
+                if problem is not None:
+                    problems.append((total, problem, '\t'.join(para)))
+                else:
+                    seen[tuple(para[:3])] = total
+            progress('Checked rows', total)
+    progress('Checked rows', total, total)
+    if len(problems) > 0:
+        for line_number, problem, line in problems:
+            print('{}[Invalid format]{} contestant tsv line {}: {}: {}'.format(Fore.RED, Fore.RESET, line_number, problem, line))
+        error('Found {} invalid row(s) in {}. Nothing is imported.'.format(len(problems), path))
+    if get_contestants_num() + total > contest.get_capacity():
         error("These contestants are beyond the capacity of contest.")
+    if total > contest.get_available_teamid_num():
+        error('Only {} team id(s) are available for {} contestants.'.format(contest.get_available_teamid_num(), total))
 
-    for para in lines:
-        if len(para) != 4:
-            invalid_format('contestant csv', para.join('\t'))
-        name = para[0]
-        sid = para[1]
-        aff = para[2]
-        team_cat = int(para[3])
-        contestant_id = get_available_id()
-        team_id = contest.get_available_teamid()
-        create_contestant(contestant_id, team_cat, team_id, name, sid, aff)
+    team_ids = iter(contest.reserve_teamids(total, contiguous_team_ids))
+    imported = list()
+    with timing.span('apply'):
+        for chunk in iter_chunks(iter_tsv(path), IMPORT_CHUNK_SIZE):
+            for name, sid, aff, team_cat in chunk:
+                contestant_id = get_available_id()
+                team_id = next(team_ids)
+                create_contestant(contestant_id, int(team_cat), team_id, name, sid, aff)
+                imported.append(contestant_id)
+            progress('Imported contestants', len(imported), total)
 
-    write_contestant_data()
-    info('Successfully imported {} contestants.'.format(len(lines)))
+    write_contestant_data(imported)
+    info('Successfully imported {} contestants.'.format(total))
 
 
 def remove_contestant(contestant_id):
@@ -228,14 +369,15 @@ def remove_contestant(contestant_id):
     if not ask_confirm('Are you sure to delete this contestant?', False):
         user_abort()
 
-    global g_contestants, g_contestant_unique
-    contest.release_teamid(contestant.team_id)
-    if contestant.seated():
-        unseat_contestant(contestant_id, silent=True)
-    g_contestant_unique.remove((contestant.name, contestant.sid, contestant.aff))
-    g_contestants.pop(contestant_id)
+    global g_contestants
+    with storage.transaction():
+        contest.release_teamid(contestant.team_id)
+        if contestant.seated():
+            unseat_contestant(contestant_id, silent=True)
+        unindex_contestant(contestant)
+        g_contestants.pop(contestant_id)
 
-    write_contestant_data()
+        write_contestant_data([], [contestant_id])
     info('Successfully remove contestant {}.'.format(contestant_id))
 
 
@@ -245,7 +387,7 @@ def generate_password(contestant_id, alphabet, length, override=False):
         error('Contestant {} has already have a password. Use -o to override.'.format(contestant_id))
     contestant.password = generate_random_password(alphabet, length)
 
-    write_contestant_data()
+    write_contestant_data([contestant_id])
     info('Successfully generate password for contestant {}.'.format(contestant_id))
 
 
@@ -272,27 +414,28 @@ def seat_contestant(contestant_id, manual, random_apply, room_mask, override, si
     c = contestants[contestant_id]
 
     if c.seated() and not override:
-        error('Contestant {} is already seated at {}.'.format(contestant_id, c.get_seat().to_string()))
+        error('Contestant {} is already seated at {}.'.format(contestant_id, c.seat_formatted_str))
 
-    if c.seated():
-        unseat_contestant(contestant_id, silent=True)
+    with storage.transaction():
+        if c.seated():
+            unseat_contestant(contestant_id, silent=True)
 
-    if manual:
-        room = ask_variable('room')
-        seat_id = ask_variable('seat id')
-        s = seat.occupy_seat(contestant_id, seat.Seat(room, seat_id))
-    else:
-        s = seat.apply_seat(contestant_id, random_apply, room_mask)
+        if manual:
+            room = ask_variable('room')
+            seat_id = ask_variable('seat id')
+            handle = seat.occupy_seat(contestant_id, seat.seat_handle(room, seat_id))
+        else:
+            handle = seat.apply_seat(contestant_id, random_apply, room_mask)
 
-    contestants[contestant_id].seat_formatted_str = s.to_string()
+        contestants[contestant_id].seat_handle = handle
 
-    if not silent:
-        info('Contestant {} is seated to [{}].'.format(contestant_id, s.to_string()))
-    if write:
-        write_contestant_data()
+        if not silent:
+            info('Contestant {} is seated to [{}].'.format(contestant_id, seat.handle_str(handle)))
+        if write:
+            write_contestant_data([contestant_id])
 
 
-def seat_all_contestants(random_apply, room_mask, silent=False):
+def seat_all_contestants(random_apply, room_mask, silent=False, spread=False):
     contestants = get_contestants()
     cnt = 0
     for contestant_id, contestant in contestants.items():
@@ -303,9 +446,14 @@ def seat_all_contestants(random_apply, room_mask, silent=False):
     if not ask_confirm('Are you sure to seat {} unseated contestant(s)?'.format(cnt), True):
         user_abort()
 
-    for contestant_id, contestant in contestants.items():
-        if not contestant.seated():
-            seat_contestant(contestant_id, manual=False, random_apply=random_apply, room_mask=room_mask, override=False, silent=True)
+    unseated = [contestant_id for contestant_id, contestant in contestants.items() if not contestant.seated()]
+    if spread:
+        handles = [seat.occupy_seat(contestant_id, handle) for contestant_id, handle in zip(unseated, seating.plan_seats(unseated, room_mask))]
+    else:
+        handles = seat.apply_seats(unseated, random_apply, room_mask)
+    for contestant_id, handle in zip(unseated, handles):
+        contestants[contestant_id].seat_handle = handle
+    write_contestant_data(unseated)
 
     if not silent:
         info('Successfully seated {} contestant(s).'.format(cnt))
@@ -322,14 +470,14 @@ def unseat_contestant(contestant_id, silent=False):
     if not c.seated():
         error('Contestant {} does not have a seat yet.'.format(contestant_id))
 
-    seat_str = c.seat_formatted_str
+    handle = c.seat_handle
 
-    seat.release_seat(seat.decode_seat(seat_str))
-    c.seat_formatted_str = None
+    seat.release_seat(handle)
+    c.seat_handle = None
 
     if not silent:
-        info('Contestant {} is unseated from [{}].'.format(contestant_id, seat_str))
-    write_contestant_data()
+        info('Contestant {} is unseated from [{}].'.format(contestant_id, seat.handle_str(handle)))
+    write_contestant_data([contestant_id])
 
 
 def unseat_all_contestant(silent=False):
@@ -344,18 +492,19 @@ def unseat_all_contestant(silent=False):
     if not ask_confirm('Are you sure to unseat {} seated contestant(s)?'.format(cnt), False):
         user_abort()
 
-    for contestant_id, contestant in contestants.items():
-        if contestant.seated():
-            unseat_contestant(contestant_id, silent=True)
+    with storage.transaction():
+        for contestant_id, contestant in contestants.items():
+            if contestant.seated():
+                unseat_contestant(contestant_id, silent=True)
 
     if not silent:
         info('Successfully seated {} contestant(s).'.format(cnt))
 
 
 def query_team_seat(team_id):
-    if team_id not in team_id2id:
+    c = find_contestant('team_id', team_id)
+    if c is None:
         error('Team {} does not exists.'.format(team_id))
-    c = get_contestants()[team_id2id[team_id]]
     if c.seat_formatted_str:
         print('[{}] {}'.format(c.seat_formatted_str, c.name))
     else:
@@ -1,73 +1,119 @@
+import concurrent.futures
 import time
 import os
-import xlsxwriter as xw
+import shutil
+from array import array
 
 from util import *
 import contest
 import contestant
+import history
 import seat
 import affiliation
+import timing
+
+
+# Contestants from which `export all` writes its two workbooks in two processes; below it starting a process costs more than it saves.
+PARALLEL_EXPORT_THRESHOLD = 2000
+# Contestants from which the contestant workbooks are always written in xlsxwriter's constant memory mode.
+CONSTANT_MEMORY_EXPORT_THRESHOLD = 20000
+
+
+def domjudge_account_row(c):
+    return ['team', c.name, c.get_account(), c.password]
+
+
+def domjudge_team_item(c):
+    item = dict()
+    item['id'] = str(c.team_id)
+    item['name'] = c.name
+    item['room'] = c.seat_formatted_str
+    item['organization_id'] = c.aff
+    item['group_ids'] = [str(c.team_category)]
+    return item
+
+
+def domjudge_hash(c):
+    """Hash of everything exported to DOMjudge for a contestant, to find the contestants changed since an export."""
+    import hashlib
+    import json
+
+    content = json.dumps([domjudge_account_row(c), domjudge_team_item(c)], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
 
 
 def export_domjudge_account(path, cid):
     data = list()
     data.append(['accounts', '1'])
-    c = contestant.get_contestants()[cid]
-    data.append(['team', c.name, c.get_account(), c.password])
+    data.append(domjudge_account_row(contestant.get_contestants()[cid]))
     write_tsv(path, data)
 
 
-def export_domjudge_accounts(path):
+def export_domjudge_accounts(path, contestants):
     data = list()
     data.append(['accounts', '1'])
-    for _, c in contestant.get_contestants().items():
-        data.append(['team', c.name, c.get_account(), c.password])
+    for c in contestants:
+        data.append(domjudge_account_row(c))
     write_tsv(path, data)
 
 
 def export_domjudge_team(path, cid):
-    data = list()
-    c = contestant.get_contestants()[cid]
-    item = dict()
-    item['id'] = str(c.team_id)
-    item['name'] = c.name
-    item['room'] = c.seat_formatted_str
-    item['organization_id'] = c.aff
-    item['group_ids'] = [str(c.team_category)]
-    data.append(item)
-    write_json(path, data)
+    write_json(path, [domjudge_team_item(contestant.get_contestants()[cid])])
 
 
-def export_domjudge_teams(path):
-    data = list()
-    for _, c in contestant.get_contestants().items():
-        item = dict()
-        item['id'] = str(c.team_id)
-        item['name'] = c.name
-        item['room'] = c.seat_formatted_str
-        item['organization_id'] = c.aff
-        item['group_ids'] = [str(c.team_category)]
-        data.append(item)
-    write_json(path, data)
+def export_domjudge_teams(path, contestants):
+    write_json(path, [domjudge_team_item(c) for c in contestants])
+
+
+def domjudge_state_path():
+    return Path('.') / 'export' / 'domjudge' / 'state.json'
+
+
+def write_domjudge_state(state):
+    """Record what DOMjudge holds after an export: the account and content hash of each team id."""
+    write_json(domjudge_state_path(), state)
+
 
+def read_domjudge_state():
+    path = domjudge_state_path()
+    if not path.is_file():
+        return None
+    return read_json(path)
 
+
+def staging_path(kind):
+    """Return an empty directory to write the files of an export into before they are published."""
+    path = Path('.') / 'export' / kind / '.staging'
+    if path.exists():
+        shutil.rmtree(path)
+    path.mkdir(parents=True)
+    return path
+
+
+@timing.timed
+def publish(kind, paths, fingerprint=None):
+    """Record the files written in the staging directory in the export history, then move them in place."""
+    history.record(kind, paths, fingerprint)
+    for path in paths:
+        os.replace(path, Path('.') / 'export' / kind / path.name)
+    paths[0].parent.rmdir()
+
+
+@timing.timed
 def export_domjudge(contestant_id=-1):
     (Path('.') / 'export').mkdir(exist_ok=True)
     (Path('.') / 'export' / 'domjudge').mkdir(exist_ok=True)
 
     if contestant_id == -1:
-        (Path('.') / 'export' / 'domjudge' / 'history').mkdir(exist_ok=True)
+        root_path = staging_path('domjudge')
 
-        cur_time = time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())
-        root_path = Path('.') / 'export' / 'domjudge' / 'history' / cur_time
-        root_path.mkdir()
-
-        export_domjudge_accounts(root_path / 'accounts.tsv')
-        export_domjudge_teams(root_path / 'teams.json')
+        contestants = list(contestant.get_contestants().values())
+        export_domjudge_accounts(root_path / 'accounts.tsv', contestants)
+        export_domjudge_teams(root_path / 'teams.json', contestants)
+        publish('domjudge', [root_path / 'accounts.tsv', root_path / 'teams.json'])
+        write_domjudge_state(dict((str(c.team_id), [c.get_account(), domjudge_hash(c)]) for c in contestants))
 
         normal_path = Path('.') / 'export' / 'domjudge'
-        os.system("cp {} {}".format(root_path / 'accounts.tsv', normal_path / 'accounts.tsv'))
-        os.system("cp {} {}".format(root_path / 'teams.json', normal_path / 'teams.json'))
         with open(normal_path / 'timestamp.txt', 'w', encoding='utf-8') as f:
             f.write(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
 
@@ -88,125 +134,377 @@ def export_domjudge(contestant_id=-1):
         info("Successfully export DOMJudge data for contestant {}.".format(c.id))
 
 
+# Ways to split the contestants selected by `export domjudge` into separate pairs of files.
+DOMJUDGE_SPLITS = ['room', 'affiliation', 'category', 'contestant']
+
+
+def parse_id_selector(selector):
+    """Return the contestant ids of a comma-separated list of ids and ranges such as `1,4,10-20`."""
+    ids = set()
+    for part in selector.split(','):
+        part = part.strip()
+        try:
+            if '-' in part:
+                low, high = part.split('-', 1)
+                ids.update(range(int(low), int(high) + 1))
+            else:
+                ids.add(int(part))
+        except ValueError:
+            invalid_format('Contestant id', part)
+    return ids
+
+
+def domjudge_split_key(c, split):
+    if split == 'room':
+        return c.get_room()
+    if split == 'affiliation':
+        return c.aff
+    if split == 'category':
+        return str(c.team_category)
+    return '{}-{}-{}-{}'.format(str(c.id), c.aff, c.name, c.get_account())
+
+
+@timing.timed
+def export_domjudge_selection(ids=None, rooms=None, affiliations=None, categories=None, split=None):
+    """Export the contestants matching every given selector in one pass over them.
+
+    Each selector is a list of accepted values, None accepts all. With `split` the selected contestants are
+    written as one `accounts.tsv` and `teams.json` per room, affiliation or team category, or as a pair of
+    files per contestant; otherwise as a single pair.
+    """
+    if split is not None and split not in DOMJUDGE_SPLITS:
+        invalid_arg('split', split)
+    if rooms is not None:
+        seat.get_seats()
+        for room in rooms:
+            if room not in seat.g_rooms:
+                error('Room {} not found.'.format(room))
+    if affiliations is not None:
+        for aff in affiliations:
+            if aff not in affiliation.get_affiliations():
+                error('Affiliation {} not found.'.format(aff))
+    if categories is not None:
+        for cat in categories:
+            if not contest.valid_team_category(cat):
+                error('Team category {} not found.'.format(cat))
+
+    groups = dict()
+    for c in contestant.get_contestants().values():
+        if ids is not None and c.id not in ids:
+            continue
+        if affiliations is not None and c.aff not in affiliations:
+            continue
+        if categories is not None and c.team_category not in categories:
+            continue
+        if rooms is not None and c.get_room() not in rooms:
+            continue
+        groups.setdefault(None if split is None else domjudge_split_key(c, split), list()).append(c)
+
+    if ids is not None:
+        missing = ids - contestant.get_contestants().keys()
+        if len(missing) > 0:
+            warning('{} contestant id(s) not found: {}'.format(len(missing), ','.join(str(i) for i in sorted(missing)[:20])))
+    if len(groups) == 0:
+        error('No contestant matches the selection.')
+
+    cur_time = time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())
+    root_path = Path('.') / 'export' / 'domjudge' / 'selection' / cur_time
+    suffix = 1
+    while root_path.exists():
+        root_path = root_path.with_name('{}-{}'.format(cur_time, suffix))
+        suffix += 1
+    root_path.mkdir(parents=True)
+    for key in sorted(groups, key=lambda key: natural_key(key or '')):
+        if split is None:
+            accounts_path, teams_path = root_path / 'accounts.tsv', root_path / 'teams.json'
+        elif split == 'contestant':
+            accounts_path, teams_path = root_path / (key + '.tsv'), root_path / (key + '.json')
+        else:
+            (root_path / key).mkdir()
+            accounts_path, teams_path = root_path / key / 'accounts.tsv', root_path / key / 'teams.json'
+        export_domjudge_accounts(accounts_path, groups[key])
+        export_domjudge_teams(teams_path, groups[key])
 
-def export_contestants(path, print_account_password):
-    workbook = xw.Workbook(path)
+    info('Exported {} contestant(s) in {} set(s) of files to {}.'.format(sum(len(g) for g in groups.values()), len(groups), root_path))
+
+
+@timing.timed
+def export_domjudge_delta():
+    """Export the accounts and teams added or changed since the last DOMjudge export, and the teams removed since."""
+    (Path('.') / 'export').mkdir(exist_ok=True)
+    (Path('.') / 'export' / 'domjudge').mkdir(exist_ok=True)
+    (Path('.') / 'export' / 'domjudge' / 'delta').mkdir(exist_ok=True)
+
+    state = read_domjudge_state()
+    if state is None:
+        warning('No earlier DOMJudge export found, every contestant is exported as added.')
+        state = dict()
+
+    new_state = dict()
+    changed = list()
+    added = 0
+    for c in contestant.get_contestants().values():
+        team_id = str(c.team_id)
+        new_state[team_id] = [c.get_account(), domjudge_hash(c)]
+        if team_id not in state:
+            added += 1
+            changed.append(c)
+        elif state[team_id][1] != new_state[team_id][1]:
+            changed.append(c)
+    removed = [[team_id, account] for team_id, (account, _) in state.items() if team_id not in new_state]
+
+    if len(changed) == 0 and len(removed) == 0:
+        info('DOMJudge data is up to date, nothing to export.')
+        return
+
+    cur_time = time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())
+    root_path = Path('.') / 'export' / 'domjudge' / 'delta' / cur_time
+    root_path.mkdir()
+    export_domjudge_accounts(root_path / 'accounts.tsv', changed)
+    export_domjudge_teams(root_path / 'teams.json', changed)
+    write_tsv(root_path / 'removed.tsv', removed)
+    write_domjudge_state(new_state)
+
+    info('Exported {} added, {} changed and {} removed team(s) to {}.'.format(added, len(changed) - added, len(removed), root_path))
+    if len(removed) > 0:
+        warning('Delete the teams and accounts listed in {} from DOMJudge by hand.'.format(root_path / 'removed.tsv'))
+
+
+def available_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def collect_contestant_sheets():
+    """Index the contestants of each sheet of the contestant workbooks in one pass.
+
+    Returns the (sheet name, contestant ids) of each room and then each affiliation, the ids in the order of the
+    Global sheet. Rows are only built while they are written, so no sheet holds a copy of the data.
+    """
+    affiliations = affiliation.get_affiliations()
+    rooms = dict()
+    affs = dict()
+    for contestant_id, c in contestant.get_contestants().items():
+        room = c.get_room()
+        if room not in rooms:
+            rooms[room] = array('i')
+        rooms[room].append(contestant_id)
+        if c.aff not in affs:
+            affs[c.aff] = array('i')
+        affs[c.aff].append(contestant_id)
+    sheets = [(room[:30], ids) for room, ids in rooms.items()]  # sheet name should not exceed 30
+    sheets += [(affiliations[aff][:30], ids) for aff, ids in affs.items()]
+    return sheets
+
+
+def contestant_table_fingerprint(sheets):
+    """SHA-256 of the rows and sheets of the contestant workbooks, without the timestamp they are written with."""
+    import hashlib
+    import json
+
+    h = hashlib.sha256()
+    for c in contestant.get_contestants().values():
+        h.update(json.dumps(contestant_row(c, True), ensure_ascii=False).encode('utf-8') + b'\n')
+    for name, ids in sheets:
+        h.update(json.dumps(name, ensure_ascii=False).encode('utf-8') + b'\n')
+        h.update(ids.tobytes())
+    return h.hexdigest()
+
+
+def contestant_row(c, print_account_password):
+    # contestant id, name, aff, sid, seat, account, password
+    if print_account_password:
+        return [c.id, c.name, c.get_affiliation_fullname(), c.sid, c.seat_formatted_str, c.get_account(), c.password]
+    return [c.id, c.name, c.get_affiliation_fullname(), c.sid, c.seat_formatted_str]
+
+
+def export_contestants(path, timestamp, sheets, print_account_password, constant_memory=False):
+    """Write a contestant workbook with the sheets from collect_contestant_sheets().
+
+    Rows are written in order, one sheet after the other, so that in constant memory mode xlsxwriter only keeps
+    the current row in memory and streams the rest to temporary files.
+    """
+    import xlsxwriter as xw
+
+    workbook = xw.Workbook(path, {'constant_memory': constant_memory})
 
     center_format = workbook.add_format({
         'align': 'center',
         'valign': 'vcenter',
     })
 
-    room_dict = dict()
-    aff_dict = dict()
-
     if print_account_password:
         header = ['编号', '姓名', '学校', '学号', '座位', '账号', '密码']
     else:
         header = ['编号', '姓名', '学校', '学号', '座位']
 
-    cur_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    def finish(ws):
+        # xlsxwriter keeps the temporary file of every sheet open until close(); close those that are complete
+        # so that contests with thousands of sheets do not run out of file descriptors. They are reopened by close().
+        # Worksheet._opt_close() is private: checked against xlsxwriter 3.2.9, see supports_constant_memory().
+        if constant_memory:
+            ws._opt_close()
+
     timestamp_ws = workbook.add_worksheet('Timestamp')
     timestamp_ws.activate()
-    timestamp_ws.write(0, 0, cur_time)
-    
+    timestamp_ws.write(0, 0, timestamp)
+    finish(timestamp_ws)
+
+    contestants = contestant.get_contestants()
     global_ws = workbook.add_worksheet('Global')
     global_ws.activate()
-    # contestant id, name, aff, sid, seat, account, password
-    if print_account_password:
-        global_ws.write_row('A1', header, center_format)
-    else:
-        global_ws.write_row('A1', header, center_format)
-    row_number = 2
-    for _, c in contestant.get_contestants().items():
-        row = 'A' + str(row_number)
-        row_number += 1
-        if print_account_password:
-            data = [c.id, c.name, c.get_affiliation_fullname(), c.sid, c.seat_formatted_str, c.get_account(), c.password]
-        else:
-            data = [c.id, c.name, c.get_affiliation_fullname(), c.sid, c.seat_formatted_str]
-        global_ws.write_row(row, data, center_format)
-        room = seat.decode_seat(c.seat_formatted_str).room
-        if room not in room_dict:
-            room_dict[room] = []
-        room_dict[room].append(data)
-        aff = c.aff
-        if aff not in aff_dict:
-            aff_dict[aff] = []
-        aff_dict[aff].append(data)
-
-    for room, data in room_dict.items():
-        room_ws = workbook.add_worksheet(room[:30])  # sheet name should not exceed 30
-        room_ws.activate()
-        room_ws.write_row('A1', header, center_format)
-        row_number = 2
-        for c in data:
-            row = 'A' + str(row_number)
-            row_number += 1
-            room_ws.write_row(row, c, center_format)
-
-    for aff, data in aff_dict.items():
-        aff_ws = workbook.add_worksheet(affiliation.get_affiliations()[aff][:30])  # sheet name should not exceed 30
-        aff_ws.activate()
-        aff_ws.write_row('A1', header, center_format)
-        row_number = 2
-        for c in data:
-            row = 'A' + str(row_number)
-            row_number += 1
-            aff_ws.write_row(row, c, center_format)
-    
+    global_ws.write_row('A1', header, center_format)
+    for row_number, c in enumerate(contestants.values(), 1):
+        global_ws.write_row(row_number, 0, contestant_row(c, print_account_password), center_format)
+    finish(global_ws)
+
+    for name, ids in sheets:
+        ws = workbook.add_worksheet(name)
+        ws.activate()
+        ws.write_row('A1', header, center_format)
+        for row_number, contestant_id in enumerate(ids, 1):
+            ws.write_row(row_number, 0, contestant_row(contestants[contestant_id], print_account_password), center_format)
+        finish(ws)
+
     global_ws.activate()
 
-    workbook.close()
+    # xlsxwriter writes the sheets out and zips them here.
+    with timing.span('xlsxwriter close'):
+        workbook.close()
+
+
+def fork_context():
+    """Return the multiprocessing context forking this process, or None where fork is not available.
+
+    Forked workers see the contest already loaded, including changes not yet written by a batch.
+    """
+    import multiprocessing
+
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
+
 
+def supports_constant_memory():
+    """Whether the installed xlsxwriter has the private Worksheet._opt_close() that constant memory mode relies on."""
+    import xlsxwriter as xw
 
-def export_contestant_table():
+    return hasattr(xw.worksheet.Worksheet, '_opt_close')
+
+
+@timing.timed
+def export_contestant_table(constant_memory=False):
     (Path('.') / 'export').mkdir(exist_ok=True)
     (Path('.') / 'export' / 'contestants').mkdir(exist_ok=True)
-    (Path('.') / 'export' / 'contestants' / 'history').mkdir(exist_ok=True)
-
-    cur_time = time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())
-    root_path = Path('.') / 'export' / 'contestants' / 'history' / cur_time
-    root_path.mkdir()
+    root_path = staging_path('contestants')
 
     filename_1 = '{}.xlsx'.format(contest.get_contest().title)
     filename_2 = '{} (accounts).xlsx'.format(contest.get_contest().title)
 
-    export_contestants(root_path / filename_1, print_account_password=False)
-    export_contestants(root_path / filename_2, print_account_password=True)
+    total = contestant.get_contestants_num()
+    constant_memory = constant_memory or total >= CONSTANT_MEMORY_EXPORT_THRESHOLD
+    if constant_memory and not supports_constant_memory():
+        import xlsxwriter as xw
+
+        warning('xlsxwriter {} cannot close finished sheets early, the workbooks are written without constant memory mode.'.format(xw.__version__))
+        constant_memory = False
+    with timing.span('collect'):
+        sheets = collect_contestant_sheets()
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    context = fork_context()
+    with timing.span('xlsxwriter'):
+        if total >= PARALLEL_EXPORT_THRESHOLD and available_cpus() > 1 and context is not None:
+            # The workbook with accounts is written by a forked process while this one writes the other.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                accounts = pool.submit(export_contestants, root_path / filename_2, timestamp, sheets, True, constant_memory)
+                export_contestants(root_path / filename_1, timestamp, sheets, False, constant_memory)
+                accounts.result()
+        else:
+            export_contestants(root_path / filename_1, timestamp, sheets, False, constant_memory)
+            export_contestants(root_path / filename_2, timestamp, sheets, True, constant_memory)
 
+    with timing.span('fingerprint'):
+        fingerprint = contestant_table_fingerprint(sheets)
+    publish('contestants', [root_path / filename_1, root_path / filename_2], fingerprint)
     normal_path = Path('.') / 'export' / 'contestants'
-    os.system("cp '{}' '{}'".format(root_path / filename_1, normal_path / filename_1))
-    os.system("cp '{}' '{}'".format(root_path / filename_2, normal_path / filename_2))
     with open(normal_path / 'timestamp.txt', 'w', encoding='utf-8') as f:
         f.write(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime()))
 
     info('Successfully export contestant data.')
 
 
-def export_sid_score(result_file):
+@timing.timed
+def read_results(path):
+    """Yield (line number, team id, solved, penalty) for each team of a results.tsv exported from DOMjudge, one line at a time."""
+    if not Path(path).is_file():
+        error('File not found: {}'.format(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        # The first line is the header `results <version>`.
+        next(f, None)
+        for lineno, line in enumerate(f, 2):
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            record = line.split('\t')
+            try:
+                yield lineno, int(record[0]), int(record[3]), int(record[4])
+            except (IndexError, ValueError):
+                error('{}:{}: not a line of DOMJudge results: {}'.format(path, lineno, line))
+
+
+@timing.timed
+def merge_results(result_files):
+    """Merge several results files by team id, keeping the best result of a team found in more than one.
+
+    Returns the team ids of the contestants with their result, and the (file, line, team id) of the teams
+    that are not contestants of this contest.
+    """
+    contestants = contestant.get_contestants()
+    results = dict()
+    unknown = list()
+    duplicates = 0
+    for path in result_files:
+        for lineno, team_id, solved, penalty in read_results(path):
+            if team_id not in contestant.team_id2id:
+                unknown.append([path, lineno, team_id])
+                continue
+            key = (-solved, penalty)
+            if team_id in results:
+                duplicates += 1
+                if key >= results[team_id]:
+                    continue
+            results[team_id] = key
+    if duplicates > 0:
+        warning('{} team(s) found in more than one results file, their best result is kept.'.format(duplicates))
+    return results, unknown
+
+
+@timing.timed
+def export_sid_score(result_files):
+    """Write the score of each contestant with a SID, best first, from one or more DOMJudge results files."""
     (Path('.') / 'export').mkdir(exist_ok=True)
     (Path('.') / 'export' / 'sid_score').mkdir(exist_ok=True)
-    output_file =  Path('.') / 'export' / 'sid_score' / 'sid_score.tsv'
-
-    with open(result_file, 'r', encoding='utf-8') as f:
-        scoreboard = [line.strip().split('\t') for line in f.readlines()[1: ]]
-    scoreboard = sorted(scoreboard, key=lambda record: (-int(record[3]), int(record[4])))
+    output_file = Path('.') / 'export' / 'sid_score' / 'sid_score.tsv'
+    unknown_file = Path('.') / 'export' / 'sid_score' / 'unknown_teams.tsv'
 
     contestants = contestant.get_contestants()
-    
-    if len(contestants) != len(scoreboard):
-        warning(f"Expected {len(contestants)} lines, found {len(scoreboard)} lines in results.tsv")
-    
-    output = []
-    for record in scoreboard:
-        team_id = int(record[0])
-        person = contestants[contestant.get_cid_from_tid(team_id)]
-        score = int(record[3])
-        if person.sid and len(person.sid) > 0:
-            output.append('\t'.join([str(person.sid), person.name, str(score)]))
+    results, unknown = merge_results(result_files)
+
+    if len(results) != len(contestants):
+        warning('{} contestant(s) not found in the results.'.format(len(contestants) - len(results)))
+    if len(unknown) > 0:
+        write_tsv(unknown_file, [['file', 'line', 'team_id']] + unknown)
+        warning('{} team(s) in the results are not contestants, they are listed in {}.'.format(len(unknown), unknown_file))
+    elif unknown_file.exists():
+        unknown_file.unlink()
 
+    exported = 0
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\t'.join(["学号", "姓名", "过题数"]) + '\n')
-        f.write('\n'.join(output))
-    info(f"Exported {len(output)} contestants' score with their SID")
+        f.write('\t'.join(["学号", "姓名", "过题数"]))
+        for team_id in sorted(results, key=results.__getitem__):
+            person = contestants[contestant.team_id2id[team_id]]
+            if person.sid and len(person.sid) > 0:
+                f.write('\n' + '\t'.join([str(person.sid), person.name, str(-results[team_id][0])]))
+                exported += 1
+    info(f"Exported {exported} contestants' score with their SID")
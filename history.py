@@ -0,0 +1,183 @@
+import os
+import shutil
+import time
+
+from util import *
+import contest
+
+
+# Every file kept in export history is stored once here, named after the SHA-256 of its content.
+OBJECTS_PATH = Path('.') / 'export' / 'objects'
+MANIFEST_NAME = 'manifest.json'
+
+
+def file_hash(path: Path):
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def store_object(path: Path, digest, compress):
+    """Store the file under its hash unless an identical one is stored already, and return where it is."""
+    obj = OBJECTS_PATH / digest[:2] / (digest + ('.gz' if compress else ''))
+    if obj.is_file():
+        return obj
+    obj.parent.mkdir(parents=True, exist_ok=True)
+    tmp = obj.with_name(obj.name + '.tmp')
+    if compress:
+        import gzip
+
+        with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    else:
+        shutil.copyfile(path, tmp)
+    # Stored files are shared by every history entry linking them, so they must not be edited.
+    os.chmod(tmp, 0o444)
+    os.replace(tmp, obj)
+    return obj
+
+
+def link_or_copy(src: Path, dest: Path):
+    try:
+        os.link(src, dest)
+    except OSError:
+        # File systems without hard links get a copy.
+        shutil.copyfile(src, dest)
+
+
+def get_entries(kind):
+    """Return the history entries of a kind of export, oldest first."""
+    root = Path('.') / 'export' / kind / 'history'
+    if not root.is_dir():
+        return list()
+    return sorted(path for path in root.iterdir() if path.is_dir())
+
+
+def read_manifest(entry: Path):
+    path = entry / MANIFEST_NAME
+    if not path.is_file():
+        # Made before export history was content-addressed, it holds plain copies.
+        return None
+    return read_json(path)
+
+
+def record(kind, paths, fingerprint=None):
+    """Add the files just exported to the history of `kind`, unless they are the same as in its latest entry.
+
+    Files that differ on every export, like workbooks holding the time they were written, are compared by
+    the `fingerprint` of their content instead of by their hashes when one is given.
+    Each file is stored once in OBJECTS_PATH and hard-linked into the entry, then the retention policy of
+    the contest is applied.
+    """
+    c = contest.get_contest()
+    files = dict((path.name, file_hash(path)) for path in paths)
+
+    entries = get_entries(kind)
+    if len(entries) > 0:
+        latest = read_manifest(entries[-1])
+        if latest is not None and (latest['files'] == files or (
+                fingerprint is not None and latest.get('fingerprint') == fingerprint and latest['files'].keys() == files.keys())):
+            info('Exported files are the same as in {}, no history entry added.'.format(entries[-1]))
+            return
+
+    root = Path('.') / 'export' / kind / 'history'
+    root.mkdir(parents=True, exist_ok=True)
+    name = time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime())
+    entry = root / name
+    suffix = 1
+    while entry.exists():
+        entry = root / '{}-{}'.format(name, suffix)
+        suffix += 1
+    entry.mkdir()
+
+    for path in paths:
+        obj = store_object(path, files[path.name], c.history_compress)
+        link_or_copy(obj, entry / (path.name + ('.gz' if c.history_compress else '')))
+    manifest = {'files': files, 'compressed': c.history_compress}
+    if fingerprint is not None:
+        manifest['fingerprint'] = fingerprint
+    write_json(entry / MANIFEST_NAME, manifest)
+
+    if c.history_keep > 0:
+        prune(kind, c.history_keep)
+
+
+def prune(kind, keep):
+    """Delete all but the `keep` latest history entries of a kind of export, then the stored files no entry uses."""
+    entries = get_entries(kind)
+    for entry in entries[:max(0, len(entries) - keep)]:
+        shutil.rmtree(entry)
+    collect_garbage()
+
+
+def collect_garbage():
+    referenced = set()
+    for kind_path in (Path('.') / 'export').iterdir():
+        if kind_path.is_dir() and kind_path != OBJECTS_PATH:
+            for entry in get_entries(kind_path.name):
+                manifest = read_manifest(entry)
+                if manifest is not None:
+                    referenced.update(manifest['files'].values())
+
+    removed = 0
+    if OBJECTS_PATH.is_dir():
+        for obj in OBJECTS_PATH.glob('*/*'):
+            if obj.name.split('.')[0] not in referenced:
+                obj.unlink()
+                removed += 1
+        for path in OBJECTS_PATH.iterdir():
+            if path.is_dir() and not any(path.iterdir()):
+                path.rmdir()
+    return removed
+
+
+def get_usage(path: Path):
+    """Return the number of distinct files under a directory and their total size, counting hard links once."""
+    seen = set()
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                size += st.st_size
+    return len(seen), size
+
+
+def manage_history(keep=None, compress=None):
+    """Change the retention policy of export history if asked, apply it, and show what history holds."""
+    c = contest.get_contest()
+    if keep is not None:
+        if keep < 0:
+            invalid_arg('keep', keep)
+        c.history_keep = keep
+    if compress is not None:
+        c.history_compress = compress
+    if keep is not None or compress is not None:
+        c.write()
+
+    export_path = Path('.') / 'export'
+    kinds = sorted(path.name for path in export_path.iterdir() if path.is_dir() and path != OBJECTS_PATH) if export_path.is_dir() else list()
+    if c.history_keep > 0:
+        for kind in kinds:
+            prune(kind, c.history_keep)
+    elif export_path.is_dir():
+        collect_garbage()
+
+    width = 60
+    left = 10
+    print(table_line(width))
+    print(table_row('Export History', width))
+    print(table_line(width))
+    print(table_row('keep:             {}'.format('all' if c.history_keep == 0 else c.history_keep), width, left))
+    print(table_row('compress:         {}'.format('yes' if c.history_compress else 'no'), width, left))
+    for kind in kinds:
+        print(table_row('{:<18}{} entries'.format(kind + ':', len(get_entries(kind))), width, left))
+    if export_path.is_dir():
+        files, size = get_usage(export_path)
+        print(table_row('disk use:         {} files, {:.1f} MB'.format(files, size / (1 << 20)), width, left))
+    print(table_line(width))
@@ -2,15 +2,21 @@
 # PYTHON_ARGCOMPLETE_OK
 
 import argparse
+import os
 import string
 import signal
 
 import affiliation
+import batch
 import config
 import contest
 import contestant
-import export
+import history
 import seat
+import server
+import shell
+import storage
+import timing
 from util import *
 
 from pathlib import Path
@@ -28,6 +34,9 @@ def build_parser():
     """,
         formatter_class=argparse.RawTextHelpFormatter,
     )
+    parser.add_argument('--profile', action='store_true', help='Print where the time of the command went.')
+    parser.add_argument('--profile-json', type=str, metavar='FILE', help='Also write the profile to a JSON file.')
+    parser.add_argument('--profile-cprofile', type=str, metavar='FILE', help='Also run cProfile and write its statistics to a file.')
     subparsers = parser.add_subparsers(
         title='actions', dest='action', parser_class=SuppressingParser
     )
@@ -49,6 +58,7 @@ def build_parser():
     contestant_add = contestant_subparsers.add_parser('add', help='Add a contestant.')
     contestant_import = contestant_subparsers.add_parser('import', help='Import contestants from a tsv file.')
     contestant_import.add_argument('file_path', type=Path, help='Path to the file.')
+    contestant_import.add_argument('--contiguous', dest='contiguous_team_ids', action='store_true', default=False, help='Give the imported contestants consecutive team ids.')
     contestant_remove = contestant_subparsers.add_parser('remove', help='Remove a contestant.')
     contestant_remove.add_argument('id', type=int, help='ID of the contestant to remove.')
     contestant_show = contestant_subparsers.add_parser('show', help='Show information of a contestant.')
@@ -63,6 +73,7 @@ def build_parser():
     contestant_seatall = contestant_subparsers.add_parser('seatall', help='Seat all unseated contestants.')
     contestant_seatall.add_argument('--random', '-r', dest='random_apply_seat', action='store_true', default=False, help='Randomly apply a seat (for automatic mode).')
     contestant_seatall.add_argument('--room-mask', type=str, default='', help='Use only the specified room(s) for seating.')
+    contestant_seatall.add_argument('--spread', action='store_true', default=False, help='Keep contestants of the same affiliation or team category apart.')
     contestant_unseat = contestant_subparsers.add_parser('unseat', help='Unseat a contestant.')
     contestant_unseat.add_argument('id', type=int, nargs='?', default=-1, help='ID of the contestant to be unseated..')
     contestant_unseatall = contestant_subparsers.add_parser('unseatall', help='Unseat all seated contestants.')
@@ -81,6 +92,8 @@ def build_parser():
     seat_add = seat_subparsers.add_parser('add', help='Add a seat.')
     seat_add.add_argument('room', type=str)
     seat_add.add_argument('seat_id', type=str)
+    seat_add.add_argument('--row', type=int, default=None, help='Row of the seat in the room, if it cannot be parsed from the seat id.')
+    seat_add.add_argument('--col', type=int, default=None, help='Column of the seat in the room, if it cannot be parsed from the seat id.')
     seat_import = seat_subparsers.add_parser('import', help='Import seats from a tsv file.')
     seat_import.add_argument('file_path', type=Path, help='Path to the tsv file.')
     seat_remove = seat_subparsers.add_parser('remove', help='Remove a seat.')
@@ -110,36 +123,176 @@ def build_parser():
     export_subparsers = export_parser.add_subparsers(title='actions', dest='subaction', parser_class=SuppressingParser)
     export_subparsers.required = True
     export_all = export_subparsers.add_parser('all', help='Export all data.')
+    export_all.add_argument('--constant-memory', action='store_true', help='Stream the contestant workbooks to disk row by row to bound memory use.')
     export_domjudge = export_subparsers.add_parser('domjudge', help='Export accounts.tsv and teams.json for DOMJudge.')
     export_domjudge.add_argument('contestant_id', type=int, nargs='?', default=-1, const=-1, help='ID of the contestant to export. Ignore it to export all contestants.')
+    export_domjudge.add_argument('--delta', action='store_true', help='Only export the contestants added, changed or removed since the last export.')
+    export_domjudge.add_argument('--ids', type=str, help='Export only these contestants, e.g. 1,4,10-20.')
+    export_domjudge.add_argument('--rooms', type=str, help='Export only the contestants seated in these comma-separated rooms.')
+    export_domjudge.add_argument('--affiliations', type=str, help='Export only the contestants of these comma-separated affiliations.')
+    export_domjudge.add_argument('--categories', type=str, help='Export only the contestants of these comma-separated team categories.')
+    export_domjudge.add_argument('--split', choices=['room', 'affiliation', 'category', 'contestant'], help='Write the selected contestants as one pair of files per room, affiliation, category or contestant.')
     export_contestants = export_subparsers.add_parser('contestant', help='Export contestant information.')
-    export_sid_score = export_subparsers.add_parser('sid_score', help='Export each SID\'s score from an domjudge-exported result.tsv')
-    export_sid_score.add_argument('result_file', type=str, help='Path to results.tsv exported from domjudge')
+    export_contestants.add_argument('--constant-memory', action='store_true', help='Stream the contestant workbooks to disk row by row to bound memory use.')
+    export_sid_score = export_subparsers.add_parser('sid_score', help='Export each SID\'s score from domjudge-exported results.tsv files')
+    export_sid_score.add_argument('result_files', type=str, nargs='+', help='Paths to results.tsv exported from domjudge, e.g. one per division or site')
+    export_history = export_subparsers.add_parser('history', help='Show and set the retention policy of export history, and apply it.')
+    export_history.add_argument('--keep', type=int, help='Number of history entries kept per kind of export, 0 for all.')
+    export_history_compress = export_history.add_mutually_exclusive_group()
+    export_history_compress.add_argument('--compress', dest='compress', action='store_const', const=True, help='Store history files gzip-compressed.')
+    export_history_compress.add_argument('--no-compress', dest='compress', action='store_const', const=False, help='Store history files as they are.')
+
+    storage_parser = subparsers.add_parser('storage', help='Manage the storage backend.')
+    storage_subparsers = storage_parser.add_subparsers(title='actions', dest='subaction', parser_class=SuppressingParser)
+    storage_subparsers.required = True
+    storage_migrate = storage_subparsers.add_parser('migrate', help='Move all data to another storage backend.')
+    storage_migrate.add_argument('backend', type=str, choices=list(storage.backends.keys()), help='Target storage backend.')
+    storage_compact = storage_subparsers.add_parser('compact', help='Fold the change journal back into the data files.')
+
+    serve_parser = subparsers.add_parser('serve', help='Keep the contest in memory and run the commands of this directory in a daemon.')
+    shell_parser = subparsers.add_parser('shell', help='Run commands interactively against the contest loaded once.')
+    batch_parser = subparsers.add_parser('batch', help='Run the commands of a file against the contest loaded once and write all changes together.')
+    batch_parser.add_argument('file', nargs='?', default='-', help='File with one command per line, standard input by default.')
+    bench_parser = subparsers.add_parser('bench', help='Time the main operations on generated contests.')
+    bench_parser.add_argument('--sizes', type=str, default='1000,10000', help='Numbers of contestants of the generated contests, split by `,`.')
+    bench_parser.add_argument('--rooms', type=int, default=None, help='Number of rooms, one per 100 contestants by default.')
+    bench_parser.add_argument('--affiliations', type=int, default=None, help='Number of affiliations, one per 20 contestants by default.')
+    bench_parser.add_argument('--storage', type=str, default='json', help='Storage backend of the generated contests.')
+    bench_parser.add_argument('--output', type=str, default=None, help='JSON file for the results, bench-<time>.json by default.')
+    bench_parser.add_argument('--keep', type=str, default=None, help='Generate the contests in this directory and keep them.')
 
     return parser
 
 
+# Datasets that each command works on, loaded in this order before it runs.
+# Anything else is loaded lazily when it is first touched.
+# Seat occupancy is only known once the contestants are loaded, so commands looking at it need 'contestants' too.
+command_datasets = {
+    ('contest', 'lock'): ['seats', 'affiliations', 'contestants'],
+    ('contest', 'unlock'): ['seats', 'affiliations', 'contestants'],
+    ('contest', 'show'): ['seats', 'affiliations', 'contestants'],
+    ('contestant', 'add'): ['seats', 'affiliations', 'contestants'],
+    ('contestant', 'import'): ['seats', 'affiliations', 'contestants'],
+    ('contestant', 'remove'): ['contestants'],
+    ('contestant', 'show'): ['contestants'],
+    ('contestant', 'seat'): ['seats', 'contestants'],
+    ('contestant', 'seatall'): ['seats', 'contestants'],
+    ('contestant', 'unseat'): ['contestants'],
+    ('contestant', 'unseatall'): ['contestants'],
+    ('contestant', 'genpass'): ['contestants'],
+    ('seat', 'add'): ['seats'],
+    ('seat', 'import'): ['seats'],
+    ('seat', 'remove'): ['seats', 'contestants'],
+    ('seat', 'show'): [],
+    ('seat', 'showroom'): ['seats', 'contestants'],
+    ('seat', 'where'): [],
+    ('affiliation', 'add'): ['affiliations'],
+    ('affiliation', 'import'): ['affiliations'],
+    ('affiliation', 'remove'): ['affiliations', 'contestants'],
+    ('affiliation', 'show'): ['affiliations', 'contestants'],
+    ('export', 'all'): ['seats', 'affiliations', 'contestants'],
+    ('export', 'domjudge'): ['seats', 'affiliations', 'contestants'],
+    ('export', 'contestant'): ['seats', 'affiliations', 'contestants'],
+    ('export', 'sid_score'): ['contestants'],
+    ('export', 'history'): [],
+    ('storage', 'migrate'): [],
+    ('storage', 'compact'): ['contestants'],
+}
+
+dataset_loaders = {
+    'seats': seat.get_seats,
+    'affiliations': affiliation.get_affiliations,
+    'contestants': contestant.get_contestants,
+}
+
+
+def required_datasets(args):
+    if args.action == 'contestant' and args.subaction == 'show' and args.id != -1:
+        # A single contestant is read from the storage backend directly.
+        return []
+    return command_datasets[(args.action, args.subaction)]
+
+
+def parse_room_mask(room_mask):
+    if room_mask is None or len(room_mask) == 0:
+        return None
+    return room_mask.strip().split(',')
+
+
+def parse_list(value):
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if len(item.strip()) > 0]
+
+
+def parse_int_list(value, name):
+    if value is None:
+        return None
+    res = list()
+    for item in parse_list(value):
+        if not item.isdigit():
+            invalid_format(name, item)
+        res.append(int(item))
+    return res
+
+
+def profiling_requested(args):
+    return getattr(args, 'profile', False) or getattr(args, 'profile_json', None) is not None or getattr(args, 'profile_cprofile', None) is not None
+
+
 def run_parsed_arguments(args):
     config.args = args
     config.set_default_args()
 
-    action = config.args.action
+    # Inside a profiled batch, each command gets its own subtree.
+    if profiling_requested(config.args) or timing.g_enabled:
+        name = ' '.join(['cas', config.args.action] + ([config.args.subaction] if getattr(config.args, 'subaction', None) else []))
+        with timing.profiling(name, config.args.profile_json, config.args.profile_cprofile):
+            run_action(config.args.action)
+    else:
+        run_action(config.args.action)
+
 
+def run_action(action):
     if action == 'contest' and config.args.subaction == 'create':
         contest.create_contest()
         return
 
+    if action == 'bench':
+        import bench
+
+        sizes = [int(size) for size in config.args.sizes.split(',') if len(size.strip()) > 0]
+        bench.run_bench(build_parser(), run_parsed_arguments, dataset_loaders.values(), sizes, config.args.rooms,
+                        config.args.affiliations, config.args.storage, config.args.output, config.args.keep)
+        return
+
     # Ensure that current directory is the contest directory.
     contest.ensure_contest_directory()
-    # Load the seats.
-    seat.get_seats()
-    # Load the affiliations.
-    affiliation.get_affiliations()
-    # Preload the contest.
-    contest.get_contest()
-    # Preload the contestants.
-    contestant.get_contestants()
 
+    if action == 'serve':
+        server.serve(build_parser(), run_parsed_arguments, dataset_loaders.values())
+        return
+    if action == 'shell':
+        shell.run_shell(build_parser(), run_parsed_arguments, dataset_loaders.values())
+        return
+    if action == 'batch':
+        batch.run_batch(build_parser(), run_parsed_arguments, config.args.file)
+        return
+
+    with timing.span('load'):
+        # Preload the contest.
+        contest.get_contest()
+        # Load what the command needs.
+        for dataset in required_datasets(config.args):
+            dataset_loaders[dataset]()
+
+    # Every command is a single unit of work: its changes are written once, or not at all if it fails.
+    with storage.transaction():
+        with timing.span('run'):
+            dispatch_command(action)
+
+
+def dispatch_command(action):
     if action == 'contest':
         subaction = config.args.subaction
         if subaction in ['lock', 'unlock']:
@@ -157,7 +310,7 @@ def run_parsed_arguments(args):
         if subaction == 'add':
             contestant.create_contestant_interactive()
         if subaction == 'import':
-            contestant.import_contestant(config.args.file_path)
+            contestant.import_contestant(config.args.file_path, config.args.contiguous_team_ids)
         if subaction == 'remove':
             contestant.remove_contestant(config.args.id)
         if subaction == 'show':
@@ -166,13 +319,11 @@ def run_parsed_arguments(args):
             else:
                 contestant.show_information_all(config.args.print_password)
         if subaction == 'seat':
-            contestant.seat_contestant(config.args.id, manual=config.args.manual_seat, random_apply=config.args.random_apply_seat, room_mask=config.args.room_mask, override=config.args.override_seat)
+            contestant.seat_contestant(config.args.id, manual=config.args.manual_seat, random_apply=config.args.random_apply_seat, room_mask=parse_room_mask(config.args.room_mask), override=config.args.override_seat)
         if subaction == 'seatall':
-            contestant.seat_all_contestants(random_apply=config.args.random_apply_seat, room_mask=(
-                config.args.room_mask.strip().split(',')
-                if config.args.room_mask is not None and len(config.args.room_mask) > 0
-                else None)
-            )
+            if config.args.random_apply_seat and config.args.spread:
+                error('--random and --spread cannot be used together.')
+            contestant.seat_all_contestants(random_apply=config.args.random_apply_seat, room_mask=parse_room_mask(config.args.room_mask), spread=config.args.spread)
         if subaction == 'unseat':
             contestant.unseat_contestant(config.args.id)
         if subaction == 'unseatall':
@@ -198,7 +349,7 @@ def run_parsed_arguments(args):
         if subaction == 'remove':
             seat.remove_seat(config.args.room, config.args.seat_id)
         if subaction == 'show':
-            seat.show_seat(seat.Seat(config.args.room, config.args.seat_id))
+            seat.show_seat(config.args.room, config.args.seat_id)
         if subaction == 'showroom':
             seat.show_room(config.args.room)
         if subaction == 'where':
@@ -226,7 +377,26 @@ def run_parsed_arguments(args):
 
         return
 
+    if action == 'storage':
+        subaction = config.args.subaction
+
+        if contest.contest_locked()[0] and subaction in ['migrate']:
+            error('Contest "{}" has been locked.'.format(contest.get_contest().title))
+
+        if subaction == 'migrate':
+            storage.migrate(config.args.backend)
+        if subaction == 'compact':
+            contestant.write_contestant_data()
+            info('Successfully compacted contestant data.')
+
+        return
+
     if action == 'export':
+        import export
+
+        if config.args.subaction == 'history':
+            history.manage_history(config.args.keep, config.args.compress)
+            return
         if not contest.get_ready_state()[0]:
             error('Contest "{}" is not ready yet.'.format(contest.get_contest().title))
 
@@ -234,13 +404,29 @@ def run_parsed_arguments(args):
 
         if subaction == 'all':
             export.export_domjudge()
-            export.export_contestant_table()
+            export.export_contestant_table(config.args.constant_memory)
         if subaction == 'domjudge':
-            export.export_domjudge(config.args.contestant_id)
+            selectors = [config.args.ids, config.args.rooms, config.args.affiliations, config.args.categories, config.args.split]
+            selecting = any(selector is not None for selector in selectors)
+            if selecting and (config.args.delta or config.args.contestant_id != -1):
+                error('--ids, --rooms, --affiliations, --categories and --split cannot be used with --delta or a contestant id.')
+            if config.args.delta:
+                if config.args.contestant_id != -1:
+                    error('--delta exports every changed contestant, it takes no contestant id.')
+                export.export_domjudge_delta()
+            elif selecting:
+                export.export_domjudge_selection(
+                    ids=None if config.args.ids is None else export.parse_id_selector(config.args.ids),
+                    rooms=parse_list(config.args.rooms),
+                    affiliations=parse_list(config.args.affiliations),
+                    categories=parse_int_list(config.args.categories, 'Team category'),
+                    split=config.args.split)
+            else:
+                export.export_domjudge(config.args.contestant_id)
         if subaction == 'contestant':
-            export.export_contestant_table()
+            export.export_contestant_table(config.args.constant_memory)
         if subaction == 'sid_score':
-            export.export_sid_score(config.args.result_file)
+            export.export_sid_score(config.args.result_files)
 
         return
 
@@ -251,7 +437,19 @@ def main():
 
     signal.signal(signal.SIGINT, interrupt_handler)
     parser = build_parser()
-    run_parsed_arguments(parser.parse_args())
+    if '_ARGCOMPLETE' in os.environ:
+        # Shell completion: argcomplete answers and exits before anything is loaded.
+        try:
+            import argcomplete
+            argcomplete.autocomplete(parser)
+        except ImportError:
+            pass
+    # Let a running `cas serve` daemon handle the command.
+    code = server.forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    args = parser.parse_args()
+    run_parsed_arguments(args)
 
 
 if __name__ == '__main__':
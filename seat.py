@@ -1,6 +1,13 @@
+import bisect
+import heapq
+import random
+from array import array
+
 from util import *
 import config
 import contestant
+import storage
+import timing
 
 
 g_init = False
@@ -8,6 +15,24 @@ g_init = False
 g_seat_map = dict()
 # Available seats.
 g_available = set()
+# Free seat ids of each room, and a min-heap of (natural key, seat id) over them.
+# The heap may still hold seats taken since they were pushed, they are dropped when they reach the top.
+g_room_free = dict()
+g_room_heap = dict()
+# Seat ids of each room in the order they were created, and the rooms in natural order.
+g_room_seats = dict()
+g_rooms = list()
+# Coordinates (row, column) given explicitly for a seat, instead of parsed from its id.
+g_seat_coords = dict()
+# Grid of each room, built when first needed and dropped when the room changes. None if the room has no grid.
+g_room_grid = dict()
+# Seat table: each seat met by this process gets an integer handle, its index in g_handle_keys and g_handle_strs,
+# which hold its (room, seat id) and its formatted string, built when first needed. Contestants refer to their seat
+# by handle, so seat strings are only parsed when read from a file. Handles stay valid across reset(), as
+# contestants loaded later reuse them.
+g_handle_keys = list()
+g_handle_strs = list()
+g_handle_by_key = dict()
 
 
 class Seat:
@@ -19,15 +44,54 @@ class Seat:
         self.seat_id = seat_id
 
     def to_string(self):
-        return '{}-{}'.format(self.room, self.seat_id)
+        return format_seat(self.room, self.seat_id)
+
+
+def format_seat(room, seat_id):
+    return '{}-{}'.format(room, seat_id)
+
+
+def seat_handle(room, seat_id, formatted_str=None):
+    """Return the handle of a seat, adding it to the seat table if needed."""
+    key = (room, seat_id)
+    handle = g_handle_by_key.get(key)
+    if handle is None:
+        handle = len(g_handle_keys)
+        g_handle_keys.append(key)
+        g_handle_strs.append(formatted_str)
+        g_handle_by_key[key] = handle
+    elif g_handle_strs[handle] is None:
+        g_handle_strs[handle] = formatted_str
+    return handle
+
+
+def parse_seat_handle(formatted_str):
+    """Return the handle of a seat given as `room-seat_id`, as read from a file."""
+    if not valid_formatted_seat(formatted_str):
+        invalid_format('Seat', formatted_str)
+    room, _, seat_id = formatted_str.partition('-')
+    return seat_handle(room, seat_id, formatted_str)
+
+
+def handle_key(handle):
+    return g_handle_keys[handle]
+
+
+def handle_room(handle):
+    return g_handle_keys[handle][0]
+
+
+def handle_str(handle):
+    if g_handle_strs[handle] is None:
+        g_handle_strs[handle] = format_seat(*g_handle_keys[handle])
+    return g_handle_strs[handle]
 
 
-def write_seats_data():
-    path = Path('.') / 'data' / 'seats.tsv'
-    data = []
-    for seat_pair in g_seat_map:
-        data.append([seat_pair[0], seat_pair[1]])
-    write_tsv(path, data)
+@timing.timed
+def write_seats_data(changed=None, removed=()):
+    if storage.defer('seats', write_seats_data, changed, removed):
+        return
+    storage.get_backend().write_seats(g_seat_map.keys(), g_seat_coords, changed, removed)
 
 
 def valid_formatted_seat(formatted_str: str):
@@ -38,35 +102,65 @@ def valid_formatted_seat(formatted_str: str):
     return True
 
 
-def decode_seat(formatted_str):
-    if not valid_formatted_seat(formatted_str):
-        invalid_format('Seat', formatted_str)
-    seat_info = formatted_str.strip().split('-')
-    return Seat(seat_info[0], seat_info[1])
+def mark_free(seat):
+    room, seat_id = seat
+    g_available.add(seat)
+    g_room_free[room].add(seat_id)
+    heapq.heappush(g_room_heap[room], (natural_key(seat_id), seat_id))
 
 
-def create_seat(room, seat_id):
-    seat = (room, seat_id)
+def mark_taken(seat):
+    room, seat_id = seat
+    g_available.discard(seat)
+    g_room_free[room].discard(seat_id)
+
+
+def pop_first_free(room):
+    heap = g_room_heap[room]
+    free = g_room_free[room]
+    while heap[0][1] not in free:
+        heapq.heappop(heap)
+    return heapq.heappop(heap)[1]
+
+
+@timing.timed
+def create_seat(room, seat_id, row=None, col=None):
+    seat = g_handle_keys[seat_handle(room, seat_id)]
     if seat in g_seat_map:
-        error('Duplicate seat: [{}].'.format(Seat(room, seat_id).to_string()))
+        error('Duplicate seat: [{}].'.format(format_seat(room, seat_id)))
+    if row is not None:
+        g_seat_coords[seat] = (row, col)
+    g_room_grid.pop(room, None)
+    if room not in g_room_seats:
+        g_room_seats[room] = list()
+        g_room_free[room] = set()
+        g_room_heap[room] = list()
+        bisect.insort(g_rooms, room, key=natural_key)
+    g_room_seats[room].append(seat_id)
     g_seat_map[seat] = -1
-    g_available.add(seat)
+    mark_free(seat)
     return Seat(room, seat_id)
 
 
 def remove_seat(room, seat_id, silent=False):
     seat = (room, seat_id)
     if seat not in g_seat_map:
-        error('Seat [{}] does not exists.'.format(Seat(room, seat_id).to_string()))
+        error('Seat [{}] does not exists.'.format(format_seat(room, seat_id)))
     if g_seat_map[seat] != -1:
-        error('Seat [{}] is still occupied by contestant {}.'.format(Seat(room, seat_id).to_string(), g_seat_map[seat]))
+        error('Seat [{}] is still occupied by contestant {}.'.format(format_seat(room, seat_id), g_seat_map[seat]))
     g_seat_map.pop(seat)
-    if seat in g_available:
-        g_available.remove(seat)
-
-    write_seats_data()
+    g_seat_coords.pop(seat, None)
+    g_room_grid.pop(room, None)
+    mark_taken(seat)
+    g_room_seats[room].remove(seat_id)
+    if len(g_room_seats[room]) == 0:
+        for d in [g_room_seats, g_room_free, g_room_heap]:
+            d.pop(room)
+        g_rooms.remove(room)
+
+    write_seats_data([], [seat])
     if not silent:
-        info('Successfully deleted seat [{}].'.format(Seat(room, seat_id).to_string()))
+        info('Successfully deleted seat [{}].'.format(format_seat(room, seat_id)))
 
 
 def get_seats():
@@ -76,67 +170,215 @@ def get_seats():
         return g_seat_map, g_available
     g_init = True
 
-    path = Path('.') / 'data' / 'seats.tsv'
-    import_seats(path, silent=True, write=False)
+    with timing.span('load seats'):
+        for item in storage.get_backend().read_seats():
+            create_seat(*item)
 
     return g_seat_map, g_available
 
 
+def reset():
+    """Forget the loaded seats so that they are read again when next needed."""
+    global g_init
+    g_init = False
+    for d in [g_seat_map, g_available, g_room_free, g_room_heap, g_room_seats, g_rooms, g_seat_coords, g_room_grid]:
+        d.clear()
+
+
 def create_seat_interactive():
-    s = create_seat(config.args.room, config.args.seat_id)
+    if (config.args.row is None) != (config.args.col is None):
+        error('Give both --row and --col, or neither.')
+    s = create_seat(config.args.room, config.args.seat_id, config.args.row, config.args.col)
 
-    write_seats_data()
+    write_seats_data([(s.room, s.seat_id)])
     info('Created seat [{}].'.format(s.to_string()))
 
 
-def import_seats(path: Path, silent=False, write=True):
+def import_seats(path: Path):
     if not path.is_file():
         error("File not found: {}".format(path))
-    data = read_tsv(path)
+    data = storage.decode_seat_rows(path, read_tsv(path))
 
+    get_seats()
     for item in data:
-        if len(item) != 2:
-            invalid_format(path, item)
-        room = item[0]
-        seat_id = item[1]
-        create_seat(room, seat_id)
-
-    if not silent:
-        info('Successfully imported {} seats.'.format(len(data)))
-
-    if write:
-        write_seats_data()
-
-
-def apply_seat(contestant_id, random_choose, room_mask):
-    seat_map, available = get_seats()
+        create_seat(*item)
+
+    info('Successfully imported {} seats.'.format(len(data)))
+    write_seats_data([(item[0], item[1]) for item in data])
+
+
+@timing.timed
+class FreeSeatTree:
+    """Free seats of a list of rooms in a Fenwick tree, to find the room of the k-th free seat in O(log R)."""
+
+    def __init__(self, counts):
+        self.size = len(counts)
+        self.total = sum(counts)
+        self.tree = [0] + list(counts)
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+
+    def take(self, index):
+        self.total -= 1
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] -= 1
+            i += i & -i
+
+    def find(self, k):
+        """Index of the room holding the k-th free seat, counting from 0."""
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step > 0:
+            if pos + step <= self.size and self.tree[pos + step] <= k:
+                pos += step
+                k -= self.tree[pos]
+            step >>= 1
+        return pos
+
+
+def apply_seats(contestant_ids, random_choose, room_mask):
+    """Seat the given contestants in one go and return the handles of their seats.
+
+    Seats are taken in natural order of room and seat id, or arbitrarily if `random_choose` is set,
+    from the rooms in `room_mask` (all rooms if it is empty). Nothing is taken unless there are enough free seats.
+    """
+    get_seats()
     use_mask = room_mask is not None and len(room_mask) > 0
-    if use_mask:
-        filtered_avai_seats = set([seat for seat in available if seat[0] in room_mask])
-    if (not use_mask and len(available) == 0) or (use_mask and len(filtered_avai_seats) == 0):
+    rooms = [room for room in g_rooms if len(g_room_free[room]) > 0 and (not use_mask or room in room_mask)]
+    if sum(len(g_room_free[room]) for room in rooms) < len(contestant_ids):
         error('No available seats.')
+
+    res = list()
     if random_choose:
-        if not use_mask:
-            seat = available.pop()
+        # Every free seat is equally likely: a room is picked with a weight of its free seats.
+        free = FreeSeatTree([len(g_room_free[room]) for room in rooms])
+    next_room = 0
+    for contestant_id in contestant_ids:
+        if random_choose:
+            index = free.find(random.randrange(free.total))
+            free.take(index)
+            room = rooms[index]
+            seat_id = g_room_free[room].pop()
         else:
-            seat = filtered_avai_seats.pop()
-            available.remove(seat)
-    else:
-        if not use_mask:
-            seat = min(available)
-            available.remove(seat)
-        else:
-            seat = min(filtered_avai_seats)
-            filtered_avai_seats.remove(seat)
-            available.remove(seat)
-    seat_map[seat] = contestant_id
-    return Seat(seat[0], seat[1])
+            while len(g_room_free[rooms[next_room]]) == 0:
+                next_room += 1
+            room = rooms[next_room]
+            seat_id = pop_first_free(room)
+        handle = seat_handle(room, seat_id)
+        seat = g_handle_keys[handle]
+        mark_taken(seat)
+        g_seat_map[seat] = contestant_id
+        res.append(handle)
+    return res
+
+
+@timing.timed
+def apply_seat(contestant_id, random_choose, room_mask):
+    return apply_seats([contestant_id], random_choose, room_mask)[0]
+
+
+def get_room_seats(rooms):
+    """Map each of the given rooms to its seat ids in natural order."""
+    get_seats()
+    return dict((room, sorted(g_room_seats.get(room, ()), key=natural_key)) for room in rooms)
+
+
+def parse_seat_coordinates(seat_id):
+    """Coordinates of a seat id made of a row in letters and a column number, e.g. C12 is (3, 12)."""
+    match = re.match('([A-Za-z]+)([0-9]+)$', seat_id)
+    if not match:
+        return None
+    row = 0
+    for c in match.group(1).upper():
+        row = row * 26 + ord(c) - ord('A') + 1
+    return row, int(match.group(2))
+
+
+def get_seat_coordinates(room, seat_id):
+    if (room, seat_id) in g_seat_coords:
+        return g_seat_coords[(room, seat_id)]
+    return parse_seat_coordinates(seat_id)
+
+
+class RoomGrid:
+    """Seats of a room laid out row by row in a flat array, each cell holding the index of its seat id or -1."""
+    # Grids this much larger than the number of seats are not worth keeping.
+    max_sparsity = 16
+
+    def __init__(self, coords: dict):
+        self.seat_ids = list(coords.keys())
+        self.coords = coords
+        self.row_min = min(row for row, _ in coords.values())
+        self.col_min = min(col for _, col in coords.values())
+        self.rows = max(row for row, _ in coords.values()) - self.row_min + 1
+        self.cols = max(col for _, col in coords.values()) - self.col_min + 1
+        self.cells = array('i', [-1]) * (self.rows * self.cols)
+        for i, seat_id in enumerate(self.seat_ids):
+            self.cells[self.cell(*coords[seat_id])] = i
+
+    def cell(self, row, col):
+        return (row - self.row_min) * self.cols + col - self.col_min
+
+    def at(self, row, col):
+        if not (0 <= row - self.row_min < self.rows and 0 <= col - self.col_min < self.cols):
+            return None
+        i = self.cells[self.cell(row, col)]
+        return None if i == -1 else self.seat_ids[i]
+
+    def neighbours(self, seat_id):
+        """Seats directly left, right, in front of and behind the given one."""
+        row, col = self.coords[seat_id]
+        res = [self.at(row, col - 1), self.at(row, col + 1), self.at(row - 1, col), self.at(row + 1, col)]
+        return [n for n in res if n is not None]
+
+
+def get_room_grid(room):
+    """Grid of the room, or None unless every seat has coordinates and no two share a cell."""
+    if room in g_room_grid:
+        return g_room_grid[room]
+    coords = dict()
+    seen = set()
+    for seat_id in get_room_seats([room])[room]:
+        coord = get_seat_coordinates(room, seat_id)
+        if coord is None or coord in seen:
+            coords = None
+            break
+        coords[seat_id] = coord
+        seen.add(coord)
+    grid = None
+    if coords:
+        grid = RoomGrid(coords)
+        if grid.rows * grid.cols > RoomGrid.max_sparsity * len(coords):
+            grid = None
+    g_room_grid[room] = grid
+    return grid
+
+
+def get_seat_neighbours(room, seat_ids):
+    """Map each given seat id of a room to the seat ids next to it.
+
+    Uses the grid of the room if it has one. Otherwise seats sharing a row prefix (the part before the first digit)
+    are taken to be next to each other when no other seat of that row comes between them in natural order.
+    """
+    grid = get_room_grid(room)
+    if grid is not None:
+        return dict((seat_id, grid.neighbours(seat_id)) for seat_id in seat_ids)
+    res = dict((seat_id, list()) for seat_id in seat_ids)
+    ordered = sorted(seat_ids, key=natural_key)
+    for prev, cur in zip(ordered, ordered[1:]):
+        if natural_key(prev)[0] == natural_key(cur)[0]:
+            res[prev].append(cur)
+            res[cur].append(prev)
+    return res
 
 
-def occupy_seat(contestant_id, seat: Seat):
+def occupy_seat(contestant_id, handle):
     seat_map, available = get_seats()
-    seat_formatted_string = seat.to_string()
-    seat = (seat.room, seat.seat_id)
+    seat_formatted_string = handle_str(handle)
+    seat = g_handle_keys[handle]
 
     if seat not in seat_map:
         error('Cannot seat contestant {}: Seat [{}] does not exists.'.format(contestant_id, seat_formatted_string))
@@ -144,14 +386,14 @@ def occupy_seat(contestant_id, seat: Seat):
         error('Cannot seat contestant {}: Seat [{}] is already occupied by contestant {}.'.format(contestant_id, seat_formatted_string, seat_map[seat]))
 
     seat_map[seat] = contestant_id
-    available.remove(seat)
-    return Seat(seat[0], seat[1])
+    mark_taken(seat)
+    return handle
 
 
-def release_seat(seat: Seat):
+def release_seat(handle):
     seat_map, available = get_seats()
-    seat_formatted_string = seat.to_string()
-    seat = (seat.room, seat.seat_id)
+    seat_formatted_string = handle_str(handle)
+    seat = g_handle_keys[handle]
 
     if seat not in seat_map:
         error('Seat [{}] does not exists.'.format(seat_formatted_string))
@@ -159,31 +401,51 @@ def release_seat(seat: Seat):
         error('Seat [{}] is already free.'.format(seat_formatted_string))
 
     seat_map[seat] = -1
-    available.add(seat)
+    mark_free(seat)
 
 
-def show_seat(seat: Seat):
-    seat_map, available = get_seats()
-    seat_formatted_string = seat.to_string()
-    seat = (seat.room, seat.seat_id)
+def show_seat(room, seat_id):
+    seat_formatted_string = format_seat(room, seat_id)
+    if g_init:
+        exists = (room, seat_id) in g_seat_map
+    else:
+        exists = storage.get_backend().has_seat(room, seat_id)
 
-    if seat not in seat_map:
+    if not exists:
         error('Seat [{}] does not exists.'.format(seat_formatted_string))
-    if seat_map[seat] == -1:
+    c = contestant.find_contestant('seat', seat_formatted_string)
+    if c is None:
         print('Seat [{}] is free.'.format(seat_formatted_string))
     else:
-        contestant_id = seat_map[seat]
-        print('Seat [{}] is occupied by contestant {}:'.format(seat_formatted_string, contestant_id))
-        contestant.get_contestants()[contestant_id].print()
+        print('Seat [{}] is occupied by contestant {}:'.format(seat_formatted_string, c.id))
+        c.print()
+
+
+def show_room_grid(room, grid: RoomGrid):
+    seats = get_seats()[0]
+    cells = [['' for _ in range(grid.cols)] for _ in range(grid.rows)]
+    for seat_id, (row, col) in grid.coords.items():
+        contestant_id = seats[(room, seat_id)]
+        cells[row - grid.row_min][col - grid.col_min] = '{}[{}]'.format(seat_id, '' if contestant_id == -1 else contestant_id)
+    cell_width = max(len(cell) for line in cells for cell in line) + 2
+    width = max(30, cell_width * grid.cols + 2)
+    print(table_line(width))
+    print(table_row('Room {}'.format(room), width))
+    print(table_line(width))
+    for line in cells:
+        print(table_row(''.join(cell.ljust(cell_width) for cell in line), width))
+    print(table_line(width))
 
 
 def show_room(room: str):
     seats = get_seats()[0]
+    if room in g_room_seats and get_room_grid(room) is not None:
+        show_room_grid(room, get_room_grid(room))
+        return
     res = list()
-    for s in seats:
-        if s[0] != room:
-            continue
-        res.append((Seat(s[0], s[1]).to_string(), '[]' if seats[s] == -1 else '[{}]'.format(seats[s])))
+    for seat_id in g_room_seats.get(room, ()):
+        contestant_id = seats[(room, seat_id)]
+        res.append((format_seat(room, seat_id), '[]' if contestant_id == -1 else '[{}]'.format(contestant_id)))
     if len(res) == 0:
         error('Room {} not found.'.format(room))
     width = 30
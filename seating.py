@@ -0,0 +1,179 @@
+import heapq
+import random
+import time
+from array import array
+
+from util import *
+import contestant
+import seat
+import timing
+
+
+# Cost of two neighbouring contestants sharing an affiliation, and sharing a team category.
+AFFILIATION_WEIGHT = 4
+TEAM_CATEGORY_WEIGHT = 1
+# Number of the most numerous contestant groups the greedy pass looks at for each seat.
+GREEDY_CANDIDATES = 32
+# Time limit and number of swap partners tried per conflicting seat in the local search.
+REFINE_SECONDS = 2.0
+REFINE_TRIES = 16
+
+
+class SeatingPlan:
+    """Seats of the chosen rooms as flat arrays indexed by seat number, in natural order.
+
+    Contestants are reduced to a group, the pair (affiliation, team category), and the arrays hold
+    the affiliation and team category codes of the occupant of each seat, or -1 for an empty seat.
+    """
+
+    def __init__(self, rooms):
+        seat_map = seat.get_seats()[0]
+        contestants = contestant.get_contestants()
+
+        self.seats = list()
+        self.neighbours = list()
+        for room, seat_ids in seat.get_room_seats(rooms).items():
+            base = len(self.seats)
+            index = dict((seat_id, base + i) for i, seat_id in enumerate(seat_ids))
+            neighbours = seat.get_seat_neighbours(room, seat_ids)
+            for seat_id in seat_ids:
+                self.seats.append((room, seat_id))
+                self.neighbours.append([index[n] for n in neighbours[seat_id]])
+
+        self.aff_codes = dict()
+        self.cat_codes = dict()
+        self.aff = array('i', [-1] * len(self.seats))
+        self.cat = array('i', [-1] * len(self.seats))
+        # Seats taken by contestants seated before, which the plan must not move.
+        self.fixed = array('b', [0] * len(self.seats))
+        for i, s in enumerate(self.seats):
+            if seat_map[s] != -1:
+                self.place(i, contestants[seat_map[s]])
+                self.fixed[i] = 1
+
+    def place(self, i, c):
+        self.aff[i] = self.aff_codes.setdefault(c.aff, len(self.aff_codes))
+        self.cat[i] = self.cat_codes.setdefault(c.team_category, len(self.cat_codes))
+
+    def pair_cost(self, i, j):
+        if self.aff[i] == -1 or self.aff[j] == -1:
+            return 0
+        return (AFFILIATION_WEIGHT if self.aff[i] == self.aff[j] else 0) + \
+            (TEAM_CATEGORY_WEIGHT if self.cat[i] == self.cat[j] else 0)
+
+    def seat_cost(self, i):
+        return sum(self.pair_cost(i, j) for j in self.neighbours[i])
+
+    def swap(self, i, j):
+        self.aff[i], self.aff[j] = self.aff[j], self.aff[i]
+        self.cat[i], self.cat[j] = self.cat[j], self.cat[i]
+
+    def score(self):
+        """Return the number of neighbouring pairs sharing an affiliation, sharing a team category, and occupied at all."""
+        same_aff = same_cat = total = 0
+        for i in range(len(self.seats)):
+            for j in self.neighbours[i]:
+                if j < i or self.aff[i] == -1 or self.aff[j] == -1:
+                    continue
+                total += 1
+                same_aff += self.aff[i] == self.aff[j]
+                same_cat += self.cat[i] == self.cat[j]
+        return same_aff, same_cat, total
+
+
+def greedy(plan: SeatingPlan, contestants):
+    """Fill the free seats in natural order, each with the most numerous group that conflicts least with its neighbours.
+
+    A seat is left empty instead of taking a conflicting contestant while there are seats to spare.
+    Returns the seat number chosen for each contestant.
+    """
+    groups = dict()
+    for c in contestants:
+        groups.setdefault((c.aff, c.team_category), list()).append(c)
+    members = list(groups.values())
+    for group in members:
+        group.reverse()
+    # Max-heap of (-remaining members, group), entries are stale once the group has shrunk.
+    heap = [(-len(group), g) for g, group in enumerate(members)]
+    heapq.heapify(heap)
+
+    free = [i for i in range(len(plan.seats)) if plan.aff[i] == -1]
+    remaining = len(contestants)
+    res = dict()
+    for pos, i in enumerate(free):
+        if remaining == 0:
+            break
+        candidates = list()
+        best = None
+        while len(heap) > 0 and len(candidates) < GREEDY_CANDIDATES:
+            count, g = heapq.heappop(heap)
+            if -count != len(members[g]):
+                continue
+            candidates.append(g)
+            plan.place(i, members[g][-1])
+            cost = plan.seat_cost(i)
+            if best is None or cost < best[0]:
+                best = (cost, g)
+            if cost == 0:
+                break
+        cost, g = best
+        if cost > 0 and len(free) - pos > remaining:
+            plan.aff[i] = plan.cat[i] = -1
+        else:
+            plan.place(i, members[g][-1])
+            res[members[g].pop().id] = i
+            remaining -= 1
+        for candidate in candidates:
+            if len(members[candidate]) > 0:
+                heapq.heappush(heap, (-len(members[candidate]), candidate))
+    return res
+
+
+def refine(plan: SeatingPlan, assignment, rng):
+    """Swap contestants between free seats, or move them to empty ones, while that lowers the total cost."""
+    movable = [i for i in range(len(plan.seats)) if not plan.fixed[i]]
+    owner = dict((i, contestant_id) for contestant_id, i in assignment.items())
+    deadline = time.monotonic() + REFINE_SECONDS
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for i in [i for i in movable if plan.aff[i] != -1 and plan.seat_cost(i) > 0]:
+            for _ in range(REFINE_TRIES):
+                j = rng.choice(movable)
+                if plan.aff[i] == plan.aff[j] and plan.cat[i] == plan.cat[j]:
+                    continue
+                before = plan.seat_cost(i) + plan.seat_cost(j)
+                plan.swap(i, j)
+                if plan.seat_cost(i) + plan.seat_cost(j) < before:
+                    owner[i], owner[j] = owner.get(j), owner.get(i)
+                    improved = True
+                    break
+                plan.swap(i, j)
+            if time.monotonic() >= deadline:
+                break
+    return dict((contestant_id, i) for i, contestant_id in owner.items() if contestant_id is not None)
+
+
+@timing.timed
+def plan_seats(contestant_ids, room_mask):
+    """Choose seats for the given contestants so that neighbours rarely share an affiliation or a team category.
+
+    Returns the handle of the seat of each contestant, in the same order, after printing the quality of the plan.
+    """
+    seat.get_seats()
+    use_mask = room_mask is not None and len(room_mask) > 0
+    rooms = [room for room in seat.g_rooms if not use_mask or room in room_mask]
+    plan = SeatingPlan(rooms)
+    if sum(1 for i in range(len(plan.seats)) if plan.aff[i] == -1) < len(contestant_ids):
+        error('No available seats.')
+
+    contestants = contestant.get_contestants()
+    assignment = greedy(plan, [contestants[contestant_id] for contestant_id in contestant_ids])
+    assignment = refine(plan, assignment, random.Random(0))
+
+    same_aff, same_cat, total = plan.score()
+    quality = 100.0 if total == 0 else 100.0 * (1 - (AFFILIATION_WEIGHT * same_aff + TEAM_CATEGORY_WEIGHT * same_cat) /
+                                                (total * (AFFILIATION_WEIGHT + TEAM_CATEGORY_WEIGHT)))
+    info('Seating plan: {} of {} neighbouring pair(s) share an affiliation, {} share a team category. Quality score: {:.1f} / 100.'.format(
+        same_aff, total, same_cat, quality))
+    return [seat.seat_handle(*plan.seats[assignment[contestant_id]]) for contestant_id in contestant_ids]
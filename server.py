@@ -0,0 +1,182 @@
+import os
+import signal
+import socket
+import sys
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+# Unix socket of the `cas serve` daemon, in the contest directory.
+SOCKET_NAME = '.cas.sock'
+
+# Commands that are never forwarded to the daemon.
+LOCAL_ACTIONS = ['batch', 'bench', 'serve', 'shell']
+# Global options taking a value, skipped with it to find the action of a command line.
+VALUE_OPTIONS = ['--profile-json', '--profile-cprofile']
+
+
+class StreamWriter:
+    """File-like object sending everything written to it to the client as `{"out": text}` or `{"err": text}`."""
+
+    def __init__(self, f, key):
+        self.f = f
+        self.key = key
+
+    def write(self, text):
+        if len(text) > 0:
+            send(self.f, {self.key: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class StreamReader:
+    """File-like object asking the client for a line of its standard input whenever a command reads one."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def readline(self):
+        send(self.f, {'input': True})
+        message = receive(self.f)
+        return '' if message is None else message.get('line', '')
+
+    def close(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def send(f, message):
+    import json
+
+    f.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+    f.flush()
+
+
+def receive(f):
+    import json
+
+    line = f.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def server_running():
+    """Whether a `cas serve` daemon is listening in the current directory."""
+    path = Path('.') / SOCKET_NAME
+    if not path.exists():
+        return False
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def get_action(argv):
+    """The action of a command line, after the global options, or None if there is none."""
+    i = 0
+    while i < len(argv) and argv[i].startswith('-'):
+        if argv[i] in ['-h', '--help']:
+            return None
+        i += 2 if argv[i] in VALUE_OPTIONS else 1
+    return argv[i] if i < len(argv) else None
+
+
+def forward(argv):
+    """Run the command in the `cas serve` daemon of the current directory.
+
+    Returns its exit code, or None if no daemon is running and the command must be run here.
+    """
+    path = Path('.') / SOCKET_NAME
+    action = get_action(argv)
+    if action is None or action in LOCAL_ACTIONS or not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile('rwb') as f:
+        send(f, {'argv': argv})
+        while True:
+            message = receive(f)
+            if message is None:
+                print('[ERROR] The cas server closed the connection.', file=sys.stderr)
+                return 1
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'input' in message:
+                send(f, {'line': sys.stdin.readline()})
+            elif 'exit' in message:
+                return message['exit']
+
+
+def handle(conn, parser, run):
+    import session
+
+    with conn, conn.makefile('rwb') as f:
+        request = receive(f)
+        if request is None:
+            return
+        stdin = sys.stdin
+        sys.stdin = StreamReader(f)
+        try:
+            with redirect_stdout(StreamWriter(f, 'out')), redirect_stderr(StreamWriter(f, 'err')):
+                code = session.run_command(parser, run, request['argv'])
+            send(f, {'exit': code})
+        except OSError:
+            # The client went away in the middle of the command.
+            session.reset_state()
+        finally:
+            sys.stdin = stdin
+
+
+def serve(parser, run, datasets):
+    """Keep the contest of the current directory in memory and run the commands sent to SOCKET_NAME one at a time."""
+    from util import info, error
+
+    path = Path('.') / SOCKET_NAME
+    if server_running():
+        error('A cas server is already running for this contest.')
+    # Left behind by a server that did not shut down cleanly.
+    path.unlink(missing_ok=True)
+
+    for load in datasets:
+        load()
+
+    def stop(sig, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    os.chmod(path, 0o600)
+    sock.listen()
+    info('Serving {} on {}. Press Ctrl-C to stop.'.format(Path('.').resolve().name, path))
+    try:
+        while True:
+            conn, _ = sock.accept()
+            handle(conn, parser, run)
+    except KeyboardInterrupt:
+        info('Server stopped.')
+    finally:
+        sock.close()
+        path.unlink(missing_ok=True)
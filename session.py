@@ -0,0 +1,33 @@
+import traceback
+
+from util import *
+import affiliation
+import contest
+import contestant
+import seat
+import storage
+
+
+def reset_state():
+    """Drop everything loaded in memory, so that the next command reads the contest from disk again."""
+    for module in [contestant, seat, affiliation, contest, storage]:
+        module.reset()
+
+
+def run_command(parser, run, argv):
+    """Parse and run one command line against the state kept in memory, and return its exit code.
+
+    error() and exit() end the command instead of the process. A failed command has not written
+    anything (see storage.transaction()), so its half-applied changes are dropped by reloading from disk.
+    """
+    try:
+        run(parser.parse_args(argv))
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        traceback.print_exc()
+        code = 1
+    if code != 0:
+        reset_state()
+    return code
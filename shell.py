@@ -0,0 +1,62 @@
+import shlex
+import signal
+
+from util import *
+import server
+import session
+
+
+PROMPT = 'cas> '
+
+
+def run_shell(parser, run, datasets):
+    """Read commands line by line and run them against the contest loaded once in memory.
+
+    Each line is parsed like the arguments of `cas`. A failing command only ends itself, and each command
+    writes the datasets it changed before the next prompt.
+    """
+    if server.server_running():
+        error('A cas server is running for this contest, stop it or run the commands through it.')
+    try:
+        import readline  # Line editing and history for input().
+    except ImportError:
+        pass
+
+    for load in datasets:
+        load()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    info('Type "help" for the list of commands, "exit" or Ctrl-D to leave.')
+
+    while True:
+        try:
+            line = input(PROMPT)
+        except EOFError:
+            print()
+            break
+        except KeyboardInterrupt:
+            print()
+            continue
+
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        if line in ['exit', 'quit']:
+            break
+        if line == 'help':
+            parser.print_help()
+            continue
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            warning('Cannot parse the command: {}.'.format(e))
+            continue
+        if argv[0] in ['shell', 'serve']:
+            warning('"{}" cannot be run inside the shell.'.format(argv[0]))
+            continue
+
+        try:
+            session.run_command(parser, run, argv)
+        except KeyboardInterrupt:
+            print()
+            warning('Command interrupted, nothing of it was written.')
+            session.reset_state()
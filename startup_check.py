@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Check that `cas` starts quickly.
+
+Runs a command of `cas` in fresh interpreters, prints the modules that took longest to import (from
+`python -X importtime`), and fails if the fastest run went over the budget or imported a module it should not.
+
+    python startup_check.py [--budget MS] [--runs N] [--top N] [--forbid MODULE ...] [command ...]
+
+Run it in a contest directory to time a lookup, for example `python startup_check.py seat where 100`.
+"""
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from util import *
+
+
+MAIN = Path(__file__).resolve().parent / 'main.py'
+
+# Wall time in milliseconds a command may take to start, run and exit.
+DEFAULT_BUDGET_MS = 200
+# Modules that only some subcommands need, which must not be imported by the others.
+DEFAULT_FORBIDDEN = ['xlsxwriter', 'secrets']
+
+
+def parse_importtime(stderr):
+    """Return (module, depth, self us, cumulative us) for each line printed by -X importtime."""
+    res = list()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        module = name.lstrip()
+        depth = (len(name) - len(module) - 1) // 2
+        res.append((module, depth, int(fields[0]), int(fields[1])))
+    return res
+
+
+def run_cas(command, importtime=False):
+    argv = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [str(MAIN)] + command
+    start = time.perf_counter()
+    result = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, result.stderr
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the startup time of a cas command.')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_MS, help='Wall time budget in milliseconds.')
+    parser.add_argument('--runs', type=int, default=5, help='Number of timed runs, the fastest one is kept.')
+    parser.add_argument('--top', type=int, default=15, help='Number of modules to list.')
+    parser.add_argument('--forbid', nargs='*', default=DEFAULT_FORBIDDEN, help='Modules the command must not import.')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Command of cas to run, "--help" by default.')
+    args = parser.parse_args()
+    command = args.command if len(args.command) > 0 else ['--help']
+
+    _, stderr = run_cas(command, importtime=True)
+    imports = parse_importtime(stderr)
+    width = 72
+    print(table_line(width))
+    print(table_row('Slowest imports of: cas {}'.format(' '.join(command)), width))
+    print(table_line(width))
+    print(table_row('{:<44} {:>10} {:>12}'.format('module', 'self ms', 'cumul. ms'), width, 2))
+    for module, depth, self_us, cumulative_us in sorted(imports, key=lambda x: -x[3])[:args.top]:
+        print(table_row('{:<44} {:>10.1f} {:>12.1f}'.format(('  ' * depth + module)[:44], self_us / 1000, cumulative_us / 1000), width, 2))
+    print(table_line(width))
+
+    # The first run above also warmed up the bytecode caches.
+    elapsed = min(run_cas(command)[0] for _ in range(args.runs)) * 1000
+    info('Fastest of {} run(s): {:.1f} ms, budget {:.1f} ms.'.format(args.runs, elapsed, args.budget))
+
+    failed = False
+    imported = set(module for module, _, _, _ in imports)
+    for module in args.forbid:
+        if module in imported:
+            warning('{} was imported but is not needed by this command.'.format(module))
+            failed = True
+    if elapsed > args.budget:
+        warning('Startup is over the budget by {:.1f} ms.'.format(elapsed - args.budget))
+        failed = True
+    if failed:
+        sys.exit(1)
+    info('Startup is within the budget.')
+
+
+if __name__ == '__main__':
+    main()
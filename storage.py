@@ -0,0 +1,490 @@
+import os
+import re
+from contextlib import contextmanager
+
+from util import *
+import contest
+import timing
+
+
+# Number of journal records after which contestants.json is rewritten and the journal dropped.
+JOURNAL_COMPACT_THRESHOLD = 1000
+
+
+class JsonBackend:
+    """The original layout: data/contestants.json, data/seats.tsv and data/affiliations.tsv.
+
+    Changes to single contestants are appended to data/contestants.journal and replayed on load,
+    the journal is folded back into contestants.json once it grows past JOURNAL_COMPACT_THRESHOLD records.
+    Seats and affiliations are small and always rewritten, so `changed` and `removed` are ignored for them.
+    """
+    name = 'json'
+
+    def __init__(self, path=Path('.'), create=False):
+        self.path = path / 'data'
+        self.journal_records = 0
+        # Whether the last journal record was torn, the journal is then compacted on the next write.
+        self.journal_damaged = False
+
+    def contestants_path(self):
+        return self.path / 'contestants.json'
+
+    def journal_path(self):
+        return self.path / 'contestants.journal'
+
+    def seats_path(self):
+        return self.path / 'seats.tsv'
+
+    def affiliations_path(self):
+        return self.path / 'affiliations.tsv'
+
+    def read_contestants(self):
+        path = self.contestants_path()
+        if not path.is_file():
+            error('{} not found.'.format(path))
+        data = self.read_snapshot(path)
+
+        journal = self.journal_path()
+        self.journal_records = 0
+        self.journal_damaged = False
+        if not journal.is_file():
+            return data
+        import json
+
+        # Replaying is idempotent, so a journal left behind by an interrupted compaction does no harm.
+        items = dict((item['id'], item) for item in data)
+        with open(journal, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for number, line in enumerate(lines, 1):
+            # Only the last record can be torn, by an append that was interrupted; anything else is damage.
+            if not line.endswith('\n'):
+                # Records appended after it would end up on its line, so the journal is folded in before any append.
+                self.journal_damaged = True
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if number < len(lines):
+                    error('Record {} of {} is damaged.'.format(number, journal))
+                warning('Ignored the truncated last record of {}.'.format(journal))
+                self.journal_damaged = True
+                continue
+            if record['op'] == 'put':
+                items[record['item']['id']] = record['item']
+            else:
+                items.pop(record['id'], None)
+            self.journal_records += 1
+        return list(items.values())
+
+    def write_contestants(self, contestants, changed=None, removed=()):
+        if changed is None or self.journal_damaged or self.journal_records + len(changed) + len(removed) > JOURNAL_COMPACT_THRESHOLD:
+            self.compact_contestants(contestants)
+            return
+        import json
+
+        with open(self.journal_path(), 'a', encoding='utf-8') as f:
+            for contestant_id in removed:
+                f.write(json.dumps({'op': 'del', 'id': contestant_id}) + '\n')
+            for contestant_id in changed:
+                if contestant_id in contestants:
+                    f.write(json.dumps({'op': 'put', 'item': contestants[contestant_id].serialize()}, ensure_ascii=False) + '\n')
+        self.journal_records += len(changed) + len(removed)
+
+    def read_snapshot(self, path):
+        return read_json(path)
+
+    def write_snapshot(self, path, items):
+        # The journal is dropped once the snapshot is written, so a torn snapshot would lose the contest.
+        tmp = path.with_name(path.name + '.tmp')
+        write_json(tmp, items)
+        os.replace(tmp, path)
+
+    def compact_contestants(self, contestants):
+        self.write_snapshot(self.contestants_path(), [c.serialize() for _, c in contestants.items()])
+        self.journal_path().unlink(missing_ok=True)
+        self.journal_records = 0
+        self.journal_damaged = False
+
+    def find_contestant(self, field, value):
+        for item in self.read_contestants():
+            if item.get(field) == value:
+                return item
+        return None
+
+    def read_seats(self):
+        path = self.seats_path()
+        if not path.is_file():
+            error('File not found: {}'.format(path))
+        return decode_seat_rows(path, read_tsv(path))
+
+    def write_seats(self, seats, coords, changed=None, removed=()):
+        write_tsv(self.seats_path(), [[room, seat_id] + list(coords.get((room, seat_id), ())) for room, seat_id in seats])
+
+    def has_seat(self, room, seat_id):
+        return any(item[:2] == [room, seat_id] for item in self.read_seats())
+
+    def read_affiliations(self):
+        path = self.affiliations_path()
+        if not path.is_file():
+            error('File not found: {}'.format(path))
+        data = read_tsv(path)
+        for item in data:
+            if len(item) != 2:
+                invalid_format(path, item)
+        return data
+
+    def write_affiliations(self, affiliations, changed=None, removed=()):
+        write_tsv(self.affiliations_path(), [[shortname, fullname] for shortname, fullname in affiliations.items()])
+
+
+COLUMNAR_MAGIC = b'cas-columnar 1\n'
+# Smallest array typecodes, tried in order, for the packed integer columns.
+PACKED_TYPECODES = ['b', 'h', 'i', 'q']
+
+
+def pack_column(values):
+    """Return the values in an array of the smallest integer type that holds them all."""
+    from array import array
+
+    low, high = (min(values), max(values)) if len(values) > 0 else (0, 0)
+    for typecode in PACKED_TYPECODES:
+        bits = array(typecode).itemsize * 8
+        if -(1 << (bits - 1)) <= low and high < (1 << (bits - 1)):
+            return array(typecode, values)
+    error('Integers out of range: {} to {}.'.format(low, high))
+
+
+def encode_dictionary(values):
+    """Replace each value by its index in the list of distinct values, None by -1, and return (distinct values, indexes)."""
+    codes = dict()
+    res = list()
+    for value in values:
+        if value is None:
+            res.append(-1)
+            continue
+        if value not in codes:
+            codes[value] = len(codes)
+        res.append(codes[value])
+    return list(codes), res
+
+
+class ColumnarBackend(JsonBackend):
+    """Same as json, except that the snapshot of the contestants is data/contestants.columnar, one array per field.
+
+    The file is a magic line, a line of JSON with the string columns and the layout of the packed ones, then the
+    packed integer arrays. Integer fields are packed; affiliation shortnames and rooms are stored once each and
+    referenced by index. The journal is shared with json.
+    """
+    name = 'columnar'
+
+    def contestants_path(self):
+        return self.path / 'contestants.columnar'
+
+    @timing.timed
+    def read_snapshot(self, path):
+        import json
+        import sys
+        from array import array
+
+        with open(path, 'rb') as f:
+            if f.readline() != COLUMNAR_MAGIC:
+                invalid_format(path, 'not a columnar contestant snapshot')
+            header = json.loads(f.readline().decode('utf-8'))
+            body = f.read()
+
+        columns = header['strings']
+        offset = 0
+        for name, typecode, length in header['packed']:
+            column = array(typecode)
+            column.frombytes(body[offset:offset + length])
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            columns[name] = column
+            offset += length
+
+        affiliations = header['dictionaries']['affiliation']
+        rooms = header['dictionaries']['room']
+        return [{
+            'id': contestant_id,
+            'team_cat': team_cat,
+            'team_id': team_id,
+            'name': name,
+            'sid': sid,
+            'affiliation': affiliations[aff],
+            'seat': None if room < 0 else rooms[room] + '-' + seat_id,
+            'password': password,
+        } for contestant_id, team_cat, team_id, name, sid, aff, room, seat_id, password in zip(
+            columns['id'], columns['team_cat'], columns['team_id'], columns['name'], columns['sid'],
+            columns['affiliation'], columns['room'], columns['seat_id'], columns['password'])]
+
+    @timing.timed
+    def write_snapshot(self, path, items):
+        import json
+        import sys
+
+        seats = [item['seat'].split('-', 1) if item['seat'] is not None else (None, None) for item in items]
+        affiliations, affiliation_codes = encode_dictionary([item['affiliation'] for item in items])
+        rooms, room_codes = encode_dictionary([room for room, _ in seats])
+        packed = [
+            ('id', pack_column([int(item['id']) for item in items])),
+            ('team_cat', pack_column([int(item['team_cat']) for item in items])),
+            ('team_id', pack_column([int(item['team_id']) for item in items])),
+            ('affiliation', pack_column(affiliation_codes)),
+            ('room', pack_column(room_codes)),
+        ]
+        header = {
+            'byteorder': sys.byteorder,
+            'strings': {
+                'name': [item['name'] for item in items],
+                'sid': [item['sid'] for item in items],
+                'seat_id': [seat_id for _, seat_id in seats],
+                'password': [item['password'] for item in items],
+            },
+            'dictionaries': {'affiliation': affiliations, 'room': rooms},
+            'packed': [[name, column.typecode, len(column) * column.itemsize] for name, column in packed],
+        }
+
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(COLUMNAR_MAGIC)
+            f.write(json.dumps(header, ensure_ascii=False).encode('utf-8') + b'\n')
+            for _, column in packed:
+                f.write(column.tobytes())
+        os.replace(tmp, path)
+
+
+def decode_seat_rows(path, data):
+    """Check seat rows `room, seat_id[, row, column]` read from a tsv file and convert the coordinates to int."""
+    for item in data:
+        if len(item) not in [2, 4] or not all(re.match('-?[0-9]+$', x) for x in item[2:]):
+            invalid_format(path, item)
+    return [item[:2] + [int(x) for x in item[2:]] for item in data]
+
+
+CONTESTANT_COLUMNS = ['id', 'team_cat', 'team_id', 'name', 'sid', 'affiliation', 'seat', 'password']
+
+
+class SqliteBackend:
+    """All datasets in data/contest.db, indexed for point lookups and updated row by row.
+
+    `changed` lists the keys whose rows must be upserted and `removed` the keys whose rows must be deleted.
+    When `changed` is None the whole table is replaced.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path=Path('.'), create=False):
+        self.path = path / 'data' / 'contest.db'
+        if not create and not self.path.is_file():
+            error('{} not found. Run "cas storage migrate sqlite" first.'.format(self.path))
+        import sqlite3
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS contestants (
+                id INTEGER PRIMARY KEY,
+                team_cat INTEGER NOT NULL,
+                team_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                sid TEXT,
+                affiliation TEXT NOT NULL,
+                seat TEXT,
+                password TEXT
+            );
+            CREATE INDEX IF NOT EXISTS contestants_team_id ON contestants (team_id);
+            CREATE INDEX IF NOT EXISTS contestants_seat ON contestants (seat);
+            CREATE TABLE IF NOT EXISTS seats (
+                room TEXT NOT NULL,
+                seat_id TEXT NOT NULL,
+                seat_row INTEGER,
+                seat_col INTEGER,
+                PRIMARY KEY (room, seat_id)
+            );
+            CREATE TABLE IF NOT EXISTS affiliations (
+                shortname TEXT PRIMARY KEY,
+                fullname TEXT NOT NULL
+            );
+        """)
+        # Databases created before seats had coordinates.
+        if 'seat_row' not in [column[1] for column in self.conn.execute('PRAGMA table_info(seats)')]:
+            with self.conn:
+                self.conn.execute('ALTER TABLE seats ADD COLUMN seat_row INTEGER')
+                self.conn.execute('ALTER TABLE seats ADD COLUMN seat_col INTEGER')
+
+    def read_contestants(self):
+        cursor = self.conn.execute('SELECT {} FROM contestants ORDER BY id'.format(', '.join(CONTESTANT_COLUMNS)))
+        return [dict(zip(CONTESTANT_COLUMNS, row)) for row in cursor]
+
+    def write_contestants(self, contestants, changed=None, removed=()):
+        with self.conn:
+            if changed is None:
+                self.conn.execute('DELETE FROM contestants')
+                changed = contestants.keys()
+            self.conn.executemany('DELETE FROM contestants WHERE id = ?', [(i,) for i in removed])
+            rows = (contestants[i].serialize() for i in changed if i in contestants)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO contestants ({}) VALUES ({})'.format(
+                    ', '.join(CONTESTANT_COLUMNS), ', '.join(['?'] * len(CONTESTANT_COLUMNS))),
+                [[row[col] for col in CONTESTANT_COLUMNS] for row in rows])
+
+    def find_contestant(self, field, value):
+        if field not in ['id', 'team_id', 'seat']:
+            fatal('Unexpected: contestant lookup by {}.'.format(field))
+        row = self.conn.execute('SELECT {} FROM contestants WHERE {} = ?'.format(', '.join(CONTESTANT_COLUMNS), field),
+                                (value,)).fetchone()
+        return None if row is None else dict(zip(CONTESTANT_COLUMNS, row))
+
+    def read_seats(self):
+        return [list(row) if row[2] is not None else list(row[:2])
+                for row in self.conn.execute('SELECT room, seat_id, seat_row, seat_col FROM seats ORDER BY rowid')]
+
+    def write_seats(self, seats, coords, changed=None, removed=()):
+        with self.conn:
+            if changed is None:
+                self.conn.execute('DELETE FROM seats')
+                changed = seats
+            self.conn.executemany('DELETE FROM seats WHERE room = ? AND seat_id = ?', removed)
+            self.conn.executemany(
+                'INSERT INTO seats (room, seat_id, seat_row, seat_col) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (room, seat_id) DO UPDATE SET seat_row = excluded.seat_row, seat_col = excluded.seat_col',
+                [(room, seat_id) + coords.get((room, seat_id), (None, None)) for room, seat_id in changed])
+
+    def has_seat(self, room, seat_id):
+        return self.conn.execute('SELECT 1 FROM seats WHERE room = ? AND seat_id = ?', (room, seat_id)).fetchone() is not None
+
+    def read_affiliations(self):
+        return [list(row) for row in self.conn.execute('SELECT shortname, fullname FROM affiliations ORDER BY rowid')]
+
+    def write_affiliations(self, affiliations, changed=None, removed=()):
+        with self.conn:
+            if changed is None:
+                self.conn.execute('DELETE FROM affiliations')
+                changed = affiliations.keys()
+            self.conn.executemany('DELETE FROM affiliations WHERE shortname = ?', [(s,) for s in removed])
+            self.conn.executemany(
+                'INSERT INTO affiliations (shortname, fullname) VALUES (?, ?) '
+                'ON CONFLICT (shortname) DO UPDATE SET fullname = excluded.fullname',
+                [(s, affiliations[s]) for s in changed if s in affiliations])
+
+
+class RawRecord:
+    """Wraps an already serialized contestant so that it can be written without validation."""
+
+    def __init__(self, item):
+        self.item = dict((col, item.get(col)) for col in CONTESTANT_COLUMNS)
+
+    def serialize(self):
+        return self.item
+
+
+backends = {
+    JsonBackend.name: JsonBackend,
+    ColumnarBackend.name: ColumnarBackend,
+    SqliteBackend.name: SqliteBackend,
+}
+
+g_backend = None
+
+
+def get_backend():
+    global g_backend
+
+    if g_backend is not None:
+        return g_backend
+
+    name = contest.get_contest().storage
+    if name not in backends:
+        error('Unknown storage backend: {}.'.format(name))
+    g_backend = backends[name]()
+    return g_backend
+
+
+def reset():
+    global g_backend
+    g_backend = None
+
+
+def migrate(target):
+    """Copy every dataset from the current backend into `target` and switch the contest over."""
+    global g_backend
+
+    if target not in backends:
+        invalid_arg('storage backend', target)
+    source = get_backend()
+    if source.name == target:
+        normal('Contest is already stored as {}.'.format(target))
+
+    contestants = source.read_contestants()
+    seats = source.read_seats()
+    affiliations = source.read_affiliations()
+
+    dest = backends[target](create=True)
+    dest.write_affiliations(dict((shortname, fullname) for shortname, fullname in affiliations))
+    dest.write_seats([(item[0], item[1]) for item in seats], dict(((item[0], item[1]), tuple(item[2:])) for item in seats if len(item) == 4))
+    dest.write_contestants(dict((item['id'], RawRecord(item)) for item in contestants))
+
+    c = contest.get_contest()
+    c.storage = target
+    c.write()
+    g_backend = dest
+    info('Migrated {} contestants, {} seats and {} affiliations from {} to {}.'.format(
+        len(contestants), len(seats), len(affiliations), source.name, target))
+
+
+class Transaction:
+    """Collects the writes of every dataset and of contest.yaml so that each dirty one is flushed once at commit."""
+
+    def __init__(self):
+        # Dataset name -> [flush function, changed keys (None for everything), removed keys].
+        self.pending = dict()
+
+    def defer(self, dataset, flush, changed, removed):
+        if dataset not in self.pending:
+            self.pending[dataset] = [flush, set(), set()]
+        entry = self.pending[dataset]
+        if changed is None:
+            entry[1] = None
+        elif entry[1] is not None:
+            entry[1].update(changed)
+            entry[2].difference_update(changed)
+        entry[2].update(removed)
+        if entry[1] is not None:
+            entry[1].difference_update(removed)
+
+    def commit(self):
+        with timing.span('write'):
+            for dataset, (flush, changed, removed) in self.pending.items():
+                flush(changed, removed)
+        self.pending.clear()
+
+
+g_transaction = None
+
+
+@contextmanager
+def transaction():
+    """Defer all writes of contest data, the datasets and contest.yaml, until the end of the block.
+
+    Exported files are not contest data and are written right away. No contest data is written if the block is left by an exception, including the SystemExit raised by `error()`.
+    Nested blocks join the outermost transaction.
+    """
+    global g_transaction
+
+    if g_transaction is not None:
+        yield g_transaction
+        return
+    g_transaction = Transaction()
+    try:
+        yield g_transaction
+    except BaseException:
+        g_transaction = None
+        raise
+    t = g_transaction
+    g_transaction = None
+    t.commit()
+
+
+def defer(dataset, flush, changed, removed):
+    """Record a write in the open transaction. Returns False if there is none and the caller should write now."""
+    if g_transaction is None:
+        return False
+    g_transaction.defer(dataset, flush, changed, removed)
+    return True
@@ -0,0 +1,48 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import bench
+
+
+def run_cas(cwd, *argv, stdin=None):
+    return subprocess.run([sys.executable, str(ROOT / 'main.py')] + list(argv), cwd=cwd, input=stdin,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'contest'
+        bench.generate_contest(self.path, contestants=20, rooms=2, affiliations=3)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def contest_yaml(self):
+        return (self.path / 'contest.yaml').read_text(encoding='utf-8')
+
+    def test_failed_batch_keeps_lock(self):
+        (self.path / 'batch.txt').write_text('contest lock\ncontest unlock\ncontest lock\nseat where 99999\n', encoding='utf-8')
+        result = run_cas(self.path, 'batch', 'batch.txt')
+        self.assertNotEqual(result.returncode, 0, result.stdout)
+        self.assertNotIn('Traceback', result.stdout)
+        self.assertIn('Line 4', result.stdout)
+        self.assertIn('lock: false', self.contest_yaml())
+
+    def test_batch_unlocks(self):
+        result = run_cas(self.path, 'batch', stdin='contest lock\ncontest unlock\n')
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn('lock: false', self.contest_yaml())
+        result = run_cas(self.path, 'batch', stdin='contest lock\n')
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn('lock: true', self.contest_yaml())
+
+
+if __name__ == '__main__':
+    unittest.main()
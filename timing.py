@@ -0,0 +1,146 @@
+import functools
+import time
+
+
+# Whether a profiling() block is open. Profiling is decided per command, as `cas shell` and `cas serve` run many
+# in one process, so timed functions are always wrapped and only check this flag when profiling is off.
+g_enabled = False
+
+
+class Span:
+    """A named region of the code, merged over all the times it is entered under the same parent span."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.children = dict()
+
+    def child(self, name):
+        if name not in self.children:
+            self.children[name] = Span(name)
+        return self.children[name]
+
+    def self_seconds(self):
+        return max(0.0, self.seconds - sum(c.seconds for c in self.children.values()))
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'calls': self.calls,
+            'seconds': round(self.seconds, 6),
+            'self_seconds': round(self.self_seconds(), 6),
+            'children': [c.to_dict() for c in self.children.values()],
+        }
+
+
+g_root = Span('total')
+g_stack = [g_root]
+
+
+class span:
+    """Context manager timing its block as a child of the innermost open span, if profiling is enabled."""
+
+    def __init__(self, name):
+        self.name = name
+        self.node = None
+
+    def __enter__(self):
+        if g_enabled:
+            self.node = g_stack[-1].child(self.name)
+            g_stack.append(self.node)
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.node is not None:
+            self.node.seconds += time.perf_counter() - self.start
+            self.node.calls += 1
+            g_stack.pop()
+            self.node = None
+        return False
+
+
+def timed(f):
+    """Decorator recording each call of `f` as a span named after it."""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not g_enabled:
+            return f(*args, **kwargs)
+        with span(f.__name__):
+            return f(*args, **kwargs)
+
+    return wrapper
+
+
+def print_tree(node, width, depth=0):
+    from util import table_row
+
+    name = ('  ' * depth + node.name)[:44]
+    print(table_row('{:<44} {:>8} {:>11.1f} {:>11.1f}'.format(name, node.calls, node.seconds * 1000, node.self_seconds() * 1000), width, 2))
+    for c in sorted(node.children.values(), key=lambda c: -c.seconds):
+        print_tree(c, width, depth + 1)
+
+
+def report(json_path=None):
+    from util import table_line, table_row, write_json, info
+
+    width = 84
+    print(table_line(width))
+    print(table_row('Profile', width))
+    print(table_line(width))
+    print(table_row('{:<44} {:>8} {:>11} {:>11}'.format('span', 'calls', 'total ms', 'self ms'), width, 2))
+    print_tree(g_root, width)
+    print(table_line(width))
+    if json_path is not None:
+        write_json(json_path, g_root.to_dict())
+        info('Profile written to {}.'.format(json_path))
+
+
+class profiling:
+    """Record spans during the block and report them when it ends, optionally running cProfile as well.
+
+    Nested blocks, as with the commands of `cas batch --profile`, are recorded in the outermost one.
+    """
+
+    def __init__(self, name, json_path=None, cprofile_path=None):
+        self.name = name
+        self.json_path = json_path
+        self.cprofile_path = cprofile_path
+        self.outer = False
+        self.profiler = None
+
+    def __enter__(self):
+        global g_enabled, g_root, g_stack
+
+        if g_enabled:
+            self.block = span(self.name).__enter__()
+            return self
+        self.outer = True
+        g_enabled = True
+        g_root = Span(self.name)
+        g_stack = [g_root]
+        if self.cprofile_path is not None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global g_enabled
+
+        if not self.outer:
+            self.block.__exit__(*exc)
+            return False
+        g_root.seconds += time.perf_counter() - self.start
+        g_root.calls += 1
+        g_enabled = False
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.cprofile_path)
+        report(self.json_path)
+        if self.profiler is not None:
+            from util import info
+            info('cProfile statistics written to {}, read them with "python -m pstats {}".'.format(self.cprofile_path, self.cprofile_path))
+        return False
@@ -1,10 +1,27 @@
 import sys
 import re
-import yaml
-import json
-import secrets
+import itertools
 from pathlib import Path
-from colorama import Fore
+
+import timing
+
+# yaml, json, secrets and colorama are imported where they are first used, to keep `cas` quick to start.
+
+
+class LazyFore:
+    """Stands for colorama.Fore, importing colorama when a color is first needed."""
+
+    def __getattr__(self, name):
+        from colorama import Fore as fore
+        value = getattr(fore, name)
+        setattr(self, name, value)
+        return value
+
+
+Fore = LazyFore()
+
+# Answer yes to every confirmation instead of prompting, set by `cas batch`.
+g_assume_yes = False
 
 
 def user_abort(msg=None):
@@ -12,40 +29,48 @@ def user_abort(msg=None):
         print('{}[INFO]{} User abort: {}'.format(Fore.BLUE, Fore.RESET, msg))
     else:
         print('{}[INFO]{} Cancelled by user.'.format(Fore.BLUE, Fore.RESET))
-    exit(0)
+    sys.exit(0)
 
 
 def info(msg):
     print('{}[INFO]{} {}'.format(Fore.BLUE, Fore.RESET, msg))
 
 
+def progress(msg, done, total=None):
+    if total is None:
+        print('\r{}[INFO]{} {}: {}'.format(Fore.BLUE, Fore.RESET, msg, done), end='', file=sys.stderr, flush=True)
+    else:
+        print('\r{}[INFO]{} {}: {} / {}'.format(Fore.BLUE, Fore.RESET, msg, done, total),
+              end='\n' if done >= total else '', file=sys.stderr, flush=True)
+
+
 def warning(msg):
     print('{}[WARNING]{} {}'.format(Fore.YELLOW, Fore.RESET, msg))
 
 
 def normal(msg):
     info(msg)
-    exit(0)
+    sys.exit(0)
 
 
 def invalid_format(arg_name, arg_value):
     print('{}[Invalid format]{} {} is in wrong format: {}'.format(Fore.RED, Fore.RESET, arg_name, arg_value))
-    exit(1)
+    sys.exit(1)
 
 
 def invalid_arg(arg_name, arg_value):
     print('{}[Invalid argument]{} {} is invalid: {}'.format(Fore.RED, Fore.RESET, arg_name, arg_value))
-    exit(1)
+    sys.exit(1)
 
 
 def error(msg):
     print('{}[ERROR]{} {}'.format(Fore.RED, Fore.RESET, msg))
-    exit(1)
+    sys.exit(1)
 
 
 def fatal(msg):
     print('{}[FATAL]{} {}'.format(Fore.RED, Fore.RESET, msg))
-    exit(1)
+    sys.exit(1)
 
 
 def ask_variable(name, default=None):
@@ -65,34 +90,52 @@ def ask_variable(name, default=None):
 
 
 def ask_confirm(msg, default: bool):
+    if g_assume_yes:
+        return True
     confirm = ask_variable('{} (y/n)'.format(msg), 'y' if default else 'n')[0]
     if confirm not in ['y', 'Y', 'n', 'N']:
         error('Please answer y/n.')
     return True if confirm in ['y', 'Y'] else False
 
 
+@timing.timed
 def read_yaml(path: Path) -> dict:
+    import yaml
+
     with open(path, 'r', encoding='utf-8') as f:
         data = yaml.load(f, Loader=yaml.FullLoader)
     return data
 
 
 def write_yaml(path: Path, data: dict):
+    import yaml
+
     with open(path, 'w', encoding='utf-8') as f:
         yaml.dump(data=data, stream=f, allow_unicode=True)
 
 
-def read_tsv(path: Path) -> list:
+def iter_tsv(path: Path):
     with open(path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    res = []
-    for line in lines:
-        if line.endswith('\n'):
-            line = line[:-1]
-        res.append(line.split('\t'))
-    return res
+        for line in f:
+            if line.endswith('\n'):
+                line = line[:-1]
+            yield line.split('\t')
+
+
+def read_tsv(path: Path) -> list:
+    return list(iter_tsv(path))
+
 
+def iter_chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
 
+
+@timing.timed
 def write_tsv(path: Path, data: list):
     with open(path, 'w', encoding='utf-8') as f:
         for line in data:
@@ -104,13 +147,19 @@ def write_tsv(path: Path, data: list):
             f.write('\n')
 
 
+@timing.timed
 def read_json(path: Path) -> dict:
+    import json
+
     with open(path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data
 
 
+@timing.timed
 def write_json(path: Path, data):
+    import json
+
     with open(path, 'w', encoding='utf-8') as f:
         f.write(json.dumps(data, ensure_ascii=False))
 
@@ -129,7 +178,15 @@ def encode_range(low: int, high: int):
     return '{}-{}'.format(low, high)
 
 
+def natural_key(s: str):
+    """Sort key comparing the digit runs of a string by value, so that A2 comes before A10."""
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(re.split('([0-9]+)', s)))
+
+
+@timing.timed
 def generate_random_password(alphabet, length):
+    import secrets
+
     password = ''.join(secrets.choice(alphabet) for i in range(length))
     return password
 